@@ -1,13 +1,41 @@
 # -*- coding:utf-8 -*-
 """
 An open-source Python package for developing cognitive neural prostheses.
+
+Subpackages (and the names they export) are imported when first used, so
+``import engram`` does not load neo, TensorFlow or vispy
+(``from engram import *`` still imports all of them).
 """
 
+import importlib
 import logging
 logging_handler = logging.StreamHandler()
 
-from .declarative import *
-from .procedural import *
-from .episodic import *
+from .version import version as __version__
+
+_subpackages = ['declarative', 'procedural', 'episodic']
+
+# Names exported by each subpackage
+_exports = {
+    'declarative': ['ID', 'Duration', 'Bin', 'Cont', 'Trials', 'LazyData', 'ReaderData', 'FileData',
+                    'ScaledData', 'objectlist', 'objectnames', 'class_by_name'],
+    'procedural': ['models', 'train', 'predict', 'analyze', 'crossval', 'decoders', 'epochs', 'events',
+                   'filters', 'kernels', 'missingdata', 'normalization', 'resampling', 'signals',
+                   'spectral', 'splines'],
+    'episodic': ['envs'],
+}
+
+__all__ = ['logging_handler'] + _subpackages + [name for names in _exports.values() for name in names]
+
+
+def __getattr__(name):
+    if name in _subpackages:
+        return importlib.import_module('.' + name, __name__)
+    for subpackage, names in _exports.items():
+        if name in names:
+            return getattr(importlib.import_module('.' + subpackage, __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-from .version import version as __version__
\ No newline at end of file
+def __dir__():
+    return sorted(set(list(globals()) + __all__))
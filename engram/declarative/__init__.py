@@ -14,6 +14,12 @@ Classes:
 
 .. autoclass:: Cont
 
+.. autoclass:: Trials
+
+.. autoclass:: LazyData
+
+.. autoclass:: ScaledData
+
 '''
 
 import engram
@@ -21,8 +27,10 @@ from engram.declarative.id import ID
 from engram.declarative.duration import Duration
 from engram.declarative.bin import Bin
 from engram.declarative.cont import Cont
+from engram.declarative.trials import Trials
+from engram.declarative.lazy import LazyData, ReaderData, FileData, ScaledData
 
-objectlist = [ID, Duration, Bin, Cont]
+objectlist = [ID, Duration, Bin, Cont, Trials]
 
 objectnames = [ob.__name__ for ob in objectlist]
 class_by_name = dict(zip(objectnames, objectlist))
\ No newline at end of file
@@ -3,6 +3,9 @@ This module defines :class:`Bin`,  a container for binary data.
 '''
 
 import numpy as np
+from scipy import sparse
+from engram.declarative.lazy import LazyData
+from engram.procedural import splines
 
 class Bin(object):
     def __init__(self, id, data=[], timestamps = [], \
@@ -13,22 +16,28 @@ class Bin(object):
         for dim in np.shape(data): numel *= dim
 
         # Check if data is continuous or binary
-        if (len(data) > 0) and (not ((data==0) | (data==1)).all() and not timestamps):
+        if not sparse.issparse(data) and (len(data) > 0) and not isinstance(data, LazyData) \
+                and (not ((data==0) | (data==1)).all() and not timestamps):
             print( "Invalid binary input. Nothing has been stored." )
         else:
             self.id = id
-            self.timestamps = np.asarray(timestamps)
-            self.data = np.asarray(data) # Channels x Time
+            self.timestamps = [np.sort(np.asarray(times)) for times in timestamps] # Sorted spike times per unit
+            if sparse.issparse(data):
+                self.data = sparse.csr_matrix(data) # Channels x Time (sparse)
+            elif isinstance(data, LazyData):
+                self.data = data # Channels x Time (loaded on indexing)
+            else:
+                self.data = np.asarray(data) # Channels x Time
             self.representation = 'raw'
             self.metadata = metadata
 
             self.nD_labels = {}
             self.nD_labels['1D'] = np.asarray(channel_labels)
 
-            if np.ndim(data) <= 1:
+            if np.ndim(self.data) <= 1:
                 length = 0 # Time
                 for source in self.timestamps:
-                    length = np.ceil(np.maximum(np.max(source),length))
+                    length = np.ceil(np.maximum(np.max(source, initial=0),length))
                 self.nD_labels['2D'] = np.arange(0,length*self.metadata['fs'])/self.metadata['fs']
             else: 
                 self.nD_labels['2D'] = np.arange(0,np.size(self.data, 1))/self.metadata['fs']
@@ -44,17 +53,52 @@ class Bin(object):
         
         if not length:
             length =  0
-            for source,idx in enumerate(self.timestamps):
-                length = np.ceil(np.maximum(np.max(source),length))
+            for source in self.timestamps:
+                length = np.ceil(np.maximum(np.max(source, initial=0),length))
             length = length * self.metadata['fs']
-        
-        data = np.zeros((len(self.timestamps),length))
-        for idx, times in enumerate(self.timestamps):
-            rounded_indices = np.round(times*self.metadata['fs']).astype('int')
-            data[idx][rounded_indices] = 1
+        length = int(length)
+
+        # Store spikes as a sparse Channels x Time matrix instead of dense vectors
+        indices = [np.round(times*self.metadata['fs']).astype('int') for times in self.timestamps]
+        indices = [rounded_indices[(rounded_indices >= 0) & (rounded_indices < length)] for rounded_indices in indices]
+        indptr = np.concatenate(([0], np.cumsum([len(rounded_indices) for rounded_indices in indices])))
+        if indices:
+            columns = np.concatenate(indices)
+        else:
+            columns = np.empty(0, dtype='int')
+        data = sparse.csr_matrix((np.ones(len(columns), dtype=self.metadata.get('dtype', 'float64')), columns, indptr),
+                                    shape=(len(self.timestamps), length))
+        data.sum_duplicates()
+        data.data[:] = 1
 
         self.data = data
 
+    def dense(self, start=None, stop=None):
+        '''
+        Return a dense Channels x Time view of the samples between start and stop.
+        '''
+        dtype = self.metadata.get('dtype', 'float64')
+        window = self.data[:, start:stop]
+        if sparse.issparse(window):
+            return window.toarray().astype(dtype, copy=False)
+        return np.array(window, dtype=dtype)
+
     def bspline(self):
-        print( 'TO DO' )
+        '''
+        Project the spike trains of every unit onto a B-spline basis in consecutive windows of t_bin.
+        '''
+        if not sparse.issparse(self.data) and np.ndim(self.data) < 2:
+            self.makeVectorsFromTimestamps()
+
+        degree = self.metadata.get('spline_degree', 3)
+        length = int(self.metadata['t_bin'] * self.metadata['fs'])
+        basis = splines.basis(splines.knots(self.metadata.get('n_basis', 8), degree), degree, length)
+        starts = np.arange(0, self.data.shape[1], length)
+
+        self.data = splines.project(self.data, basis, starts,
+                                    dtype=self.metadata.get('dtype', 'float64')) # Units x Time x Basis
+        self.nD_labels['2D'] = (starts + length/2)/self.metadata['fs']
+        self.nD_labels['3D'] = np.arange(basis.shape[1])
+
+        return self
     
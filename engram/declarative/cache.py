@@ -0,0 +1,90 @@
+'''
+This module caches features derived from :class:`Cont` objects on disk.
+
+Entries are addressed by a hash of the raw container and of the metadata
+fields that affect the derived features, so they can be shared across
+sessions and reruns. The cache is bounded in size and evicts the least
+recently used entries first.
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+CACHE_SIZE = 10 * 2**30 # Bytes
+HASH_SIZE = 2**16 # Samples per channel hashed at once
+
+# Metadata fields that change the features derived by ID.standardize
+FIELDS = ['fs', 'bandpass_min', 'bandpass_max', 't_bin', '2D_min', '2D_max',
+            'norm', 'norm_method', 'log_transform', 'lfp_fs', 'dtype']
+
+
+def key(cont, form):
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(form.encode())
+    hasher.update(json.dumps([cont.metadata.get(field) for field in FIELDS], default=str).encode())
+    hasher.update(np.ascontiguousarray(cont.nD_labels['1D']).tobytes())
+    hasher.update(str((cont.data.shape, str(np.dtype(cont.data.dtype)))).encode())
+
+    # Hash samples block by block so lazy and memory-mapped data is never fully loaded
+    n_samples = cont.data.shape[1] if len(cont.data.shape) > 1 else cont.data.shape[0]
+    for start in range(0, n_samples, HASH_SIZE):
+        if len(cont.data.shape) > 1:
+            block = cont.data[:, start:start+HASH_SIZE]
+        else:
+            block = cont.data[start:start+HASH_SIZE]
+        hasher.update(np.ascontiguousarray(block).tobytes())
+
+    return hasher.hexdigest()
+
+
+def load(key, cont, cachedir='cache'):
+    '''
+    Replace the data and labels of a container with a cached entry.
+    Returns None if the entry does not exist.
+    '''
+    directory = os.path.join(cachedir, key)
+    if not os.path.exists(os.path.join(directory, 'labels.npz')):
+        return None
+    os.utime(directory) # Mark as recently used
+
+    cont.data = np.load(os.path.join(directory, 'data.npy'), mmap_mode='c')
+    with np.load(os.path.join(directory, 'labels.npz')) as labels:
+        for dim in ['1D', '2D', '3D']:
+            cont.nD_labels[dim] = labels[dim] if dim in labels else None
+        if 'fs' in labels and labels['fs'] != cont.metadata['fs']:
+            cont.metadata = dict(cont.metadata, fs=labels['fs'].item()) # Resampled
+
+    return cont
+
+
+def save(key, cont, cachedir='cache', max_size=CACHE_SIZE):
+    directory = os.path.join(cachedir, key)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    np.save(os.path.join(directory, 'data.npy'), np.asarray(cont.data))
+    labels = {dim: value for dim, value in cont.nD_labels.items() if value is not None}
+    labels['fs'] = cont.metadata['fs']
+    np.savez(os.path.join(directory, 'labels.npz'), **labels) # Written last to mark the entry complete
+
+    evict(cachedir, max_size)
+
+
+def evict(cachedir='cache', max_size=CACHE_SIZE):
+    entries = []
+    for name in os.listdir(cachedir):
+        directory = os.path.join(cachedir, name)
+        if os.path.isdir(directory):
+            size = sum(os.path.getsize(os.path.join(directory, filename))
+                        for filename in os.listdir(directory))
+            entries.append((os.path.getmtime(directory), size, directory))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, directory in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(directory, ignore_errors=True)
+        total -= size
@@ -1,10 +1,24 @@
 '''
 This module defines :class:`Cont`,  a container for continuous data.
 '''
-from engram.procedural import filters
+from engram.procedural import filters, spectral, normalization, resampling
+from engram.declarative.lazy import LazyData, scratch_memmap
 
 import numpy as np
-from scipy import signal
+
+CHECK_SIZE = 2**16 # Samples per channel checked at once when validating data
+
+def is_binary(data):
+    # Scan in blocks so memory-mapped and lazy recordings are never fully loaded
+    if not hasattr(data, 'shape'):
+        data = np.asarray(data)
+    if np.ndim(data) < 2:
+        return ((data==0) | (data==1)).all()
+    for start in range(0, np.size(data, 1), CHECK_SIZE):
+        block = data[:, start:start+CHECK_SIZE]
+        if not ((block==0) | (block==1)).all():
+            return False
+    return True
 
 class Cont(object):
     def __init__(self, id, data=[], timestamps = [], \
@@ -15,12 +29,15 @@ class Cont(object):
         for dim in np.shape(data): numel *= dim
 
         # Check if data is continuous or binary
-        if ((data==0) | (data==1)).all():
+        if is_binary(data):
             return "Invalid continuous input. Nothing has been stored."
         else:
             self.id = id
             self.timestamps = np.asarray(timestamps)
-            self.data = np.asarray(data) # Channels x Time
+            if isinstance(data, (LazyData, np.memmap)):
+                self.data = data # Channels x Time (loaded on indexing)
+            else:
+                self.data = np.asarray(data, dtype=metadata.get('dtype', 'float64')) # Channels x Time
             self.representation = 'raw'
             self.metadata = metadata
 
@@ -37,22 +54,19 @@ class Cont(object):
 
     def lfp(self):
 
-        lfp = np.empty(self.data.shape)
-        if np.ndim(self.data) == 2:
-            for channel in range(np.size(self.data, 0)):
-                self.data[channel, :] = filters.select('bandpass',self.data[channel, :],min=self.metadata['bandpass_min'],
-                                                    max=self.metadata['bandpass_max'],
-                                                    fs=self.metadata['fs'],
-                                                    order=5)
-            self.nD_labels['2D'] = np.asarray(range(np.size(self.data, 1)))/self.metadata['fs']
-
-        elif np.ndim(self.data) == 1:
+        if np.ndim(self.data) in (1, 2):
+            # Filter every channel at once along the time axis
             self.data = filters.select('bandpass',self.data,min=self.metadata['bandpass_min'],
                                                     max=self.metadata['bandpass_max'],
                                                     fs=self.metadata['fs'],
-                                                    order=5)
-            self.nD_labels['2D'] = range(np.size(self.data,1))/self.metadata['fs']
-            
+                                                    order=5, axis=-1,
+                                                    workers=self.metadata.get('workers', 1),
+                                                    dtype=self.metadata.get('dtype', 'float64'))
+            self.nD_labels['2D'] = np.arange(np.shape(self.data)[-1])/self.metadata['fs']
+
+            # Decimate before any further processing
+            if self.metadata.get('lfp_fs') and self.metadata['lfp_fs'] < self.metadata['fs']:
+                self.resample(self.metadata['lfp_fs'])
 
         else:
             print('Input array has too many dimensions')
@@ -63,56 +77,41 @@ class Cont(object):
 
     def stft(self):
 
-        lfp = self.lfp().data
-
-        N = 1e5
-        amp = 2 * np.sqrt(2)
-        noise_power = 0.01 * self.metadata['fs'] / 2
-        time = np.arange(N) / float(self.metadata['fs'])
-        mod = 500 * np.cos(2 * np.pi * 0.25 * time)
-        carrier = amp * np.sin(2 * np.pi * 3e3 * time + mod)
-        noise = np.random.normal(scale=np.sqrt(noise_power),
-                                    size=time.shape)
-        noise *= np.exp(-time / 5)
-        x = carrier + noise
-
-        window= int(self.metadata['t_bin'] * self.metadata['fs'])
-        c_len = lfp.shape[0]
-
-        if np.ndim(lfp) == 2:
-            for channel in range(len(lfp)):
-                temp_f, temp_t, temp_Zxx = signal.spectrogram(lfp[channel, :],
-                                                                self.metadata['fs'],
-                                                                'hann', nperseg=window)
-
-                freq_slice = np.where((temp_f >= self.metadata['2D_min']) & (temp_f <= self.metadata['2D_max']))
-                Zxx = temp_Zxx[freq_slice, :][0]
-                del temp_Zxx
-
-                if channel == 0:
-                    power = np.empty([c_len, np.shape(Zxx)[1], np.shape(Zxx)[0]], dtype=float)
-                    f = temp_f[freq_slice]
-                    t = temp_t
-                del temp_t
-                del temp_f
-                power[channel, :, :] = np.transpose(Zxx ** 2) # Channels x Time x Freq
-                del Zxx
-
-        if np.ndim(lfp) == 1:
-            temp_f, temp_t, temp_Zxx = signal.spectrogram(lfp,
-                                                            self.metadata['fs'],
-                                                            'hann', nperseg=window)
-
-            freq_slice = np.where((temp_f >= self.metadata['2D_min']) & (temp_f <= self.metadata['2D_max']))
-            Zxx = temp_Zxx[freq_slice, :][0]
-            del temp_Zxx
-            power = np.empty([c_len, np.shape(Zxx)[1], np.shape(Zxx)[0]], dtype=float)
-            f = temp_f[freq_slice]
-            t = temp_t
-            del temp_t
-            del temp_f
-            power = np.transpose(Zxx ** 2) # Time x Freq
-            del Zxx
+        if self.metadata.get('chunk_size') and np.ndim(self.data) == 2:
+            dtype = self.metadata.get('dtype', 'float64')
+            sos = filters.butter_sos(self.metadata['bandpass_min'], self.metadata['bandpass_max'],
+                                        self.metadata['fs'], order=5)
+            if self.metadata.get('lfp_fs') and self.metadata['lfp_fs'] < self.metadata['fs']:
+                # Filter at the recorded rate before decimating, as lfp() does
+                filtered = scratch_memmap(np.shape(self.data), dtype, self.metadata.get('scratch_dir'))
+                self.data = filters.chunked_filter(self.data, sos, chunk_size=self.metadata['chunk_size'],
+                                                    out=filtered)
+                self.resample(self.metadata['lfp_fs'])
+                sos = None
+            window= int(self.metadata['t_bin'] * self.metadata['fs'])
+
+            # Stream the filtered signal through the transform into a memory-mapped output
+            f, _ = spectral.frequencies(self.metadata['fs'], window, self.metadata['2D_min'], self.metadata['2D_max'])
+            _, n_frames, _ = spectral.frames(np.size(self.data, 1), self.metadata['fs'], window)
+            out = scratch_memmap((np.size(self.data, 0), n_frames, len(f)), dtype, self.metadata.get('scratch_dir'))
+            f, t, power = spectral.chunked_spectrogram(self.data, self.metadata['fs'], window,
+                                                        fmin=self.metadata['2D_min'],
+                                                        fmax=self.metadata['2D_max'],
+                                                        chunk_size=self.metadata['chunk_size'],
+                                                        sos=sos,
+                                                        workers=self.metadata.get('workers', 1),
+                                                        dtype=dtype, out=out) # Channels x Time x Freq
+        else:
+            lfp = self.lfp().data
+            window= int(self.metadata['t_bin'] * self.metadata['fs'])
+
+            # One transform over every channel, sliced to the frequencies of interest
+            f, t, power = spectral.spectrogram(lfp, self.metadata['fs'], window,
+                                                fmin=self.metadata['2D_min'],
+                                                fmax=self.metadata['2D_max'],
+                                                workers=self.metadata.get('workers', 1),
+                                                dtype=self.metadata.get('dtype', 'float64')) # Channels x Time x Freq
+            del lfp
 
         self.data = power
         self.nD_labels['2D'] = t
@@ -124,33 +123,46 @@ class Cont(object):
         return self
 
     def normalize(self):
-        if self.metadata['log_transform']:
-            self.data = 10*np.log10(self.data)
-        if self.metadata['norm_method'] == 'ZSCORE':
+        # Statistics are accumulated in one pass and applied in place, block by block
+        method = self.metadata['norm_method']
+        if method == 'ZSCORE':
             if np.ndim(self.data) == 3:
-                freqMu = np.mean(self.data,axis=1)
-                freqSig = np.std(self.data,axis=1)
-
-                for channel in range(len(self.data)):
-                    self.data[channel,:,:] = (self.data[channel] - freqMu[channel])/freqSig[channel]
-            elif np.ndim(self.data) == 2 or 1:
-                freqMu = np.mean(self.data,axis=0)
-                freqSig = np.std(self.data,axis=0)
-                self.data = (self.data - freqMu)/freqSig
+                axis = 1 # Each channel and frequency over time
+            elif np.ndim(self.data) in (1, 2):
+                axis = 0
             else:
                 print('Input array dimensions not supported for normalization.')
-        
+                return self
+            self.data = normalization.zscore(self.data, axis=axis,
+                                                log_transform=self.metadata['log_transform'])
+        else:
+            # BASELINE is applied to each trial by Duration.makeROIs
+            if self.metadata['log_transform']:
+                self.data = normalization.log_transform(self.data)
+            if method != 'BASELINE':
+                print('Normalization method not supported.')
+
         return self
 
     def resample(self,fs):
         if fs == self.metadata['fs']:
-            return 'Current frequency is already at the desired value.'
-            
-        else:
-            num_points = round(np.shape(self.data,1) * (self.metadata['fs']/fs))
-            self.data = signal.resample(self.data,num_points)
-            data = filters.select('bandpass', min=0, max=self.metadata['fs'],
-                                    fs=fs, order=5)
-            downsample = np.shape(self.data,1)/np.shape(self.data,1)
-            print('Sampled from ' + fs + ' to ' + downsample + 'Hz')
-            fs = downsample
\ No newline at end of file
+            print('Current frequency is already at the desired value.')
+            return self
+
+        out = None
+        dtype = self.metadata.get('dtype', 'float64')
+        if self.metadata.get('chunk_size'):
+            # Resample chunk by chunk into a memory-mapped output
+            shape = np.shape(self.data)[:-1] + (resampling.size(np.shape(self.data)[-1], self.metadata['fs'], fs),)
+            out = scratch_memmap(shape, dtype, self.metadata.get('scratch_dir'))
+        self.data, new_fs = resampling.resample(self.data, self.metadata['fs'], fs,
+                                                chunk_size=self.metadata.get('chunk_size'),
+                                                dtype=dtype, out=out)
+        print('Sampled from {} to {} Hz'.format(self.metadata['fs'], new_fs))
+
+        # Other containers share the metadata, so this one gets its own copy
+        start = self.nD_labels['2D'][0] if len(self.nD_labels['2D']) else 0
+        self.metadata = dict(self.metadata, fs=new_fs)
+        self.nD_labels['2D'] = start + np.arange(np.shape(self.data)[-1])/new_fs
+
+        return self
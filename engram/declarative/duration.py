@@ -3,6 +3,8 @@ This module defines :class:`Duration`,  a container for unique periods of time.
 '''
 from engram.declarative.bin import Bin
 from engram.declarative.cont import Cont
+from engram.declarative import trials
+from engram.procedural import epochs, normalization
 
 import numpy as np
 
@@ -21,7 +23,7 @@ class Duration(object):
             self.conts = []
         
         self.events = events
-        self.trial_labels = np.asarray(labels)
+        self.trial_labels = {category: np.asarray(values) for category, values in dict(labels).items()}
         self.trials = None
         self.metadata = metadata
 
@@ -38,49 +40,44 @@ class Duration(object):
     def addCont(self, data = [], timestamps = [], channel_labels = []):
         self.conts.append(Cont(self.id, data=data, timestamps=timestamps, channel_labels=channel_labels, metadata=self.metadata))
 
-    def makeROIs(self):
-        times = self.events[self.metadata['event_of_interest']]
-        
-        # Only continue if Conts and Bins have the same time vectors
-        nconts = len(self.conts)
-        nbins = len(self.bins)
-        obj_names = ['Conts','Bins']
-        objects = {obj_names[0]:self.conts, obj_names[1]: self.bins}
-        trials = np.asarray([{obj_names[0]:[], obj_names[1]: []} for _ in range(len(times))])
-
-        prev_len = None
-
-        for trial,time in enumerate(times):
-            for ii, obj_type in enumerate(objects):
-                for jj, obj in enumerate(objects[obj_type]):
-                    bounds = self.metadata['roi_bounds']
-                    upper_index = (np.abs(obj.nD_labels['2D'] - (time + bounds[1]))).argmin()
-                    lower_index = (np.abs(obj.nD_labels['2D'] - (time + bounds[0]))).argmin()
-                    diff_one = upper_index-lower_index
-                    if prev_len:
-                        if prev_len != diff_one:
-                            diff_two = prev_len - diff_one
-                            if diff_one % 2:
-                                center = lower_index+diff_one/2
-                                offset = (prev_len+1)/2
-                                upper_index = center + offset
-                                lower_index = center - offset
-                                upper_index += diff_two
-                            else:
-                                upper_index += diff_two
-
-                    if np.ndim(obj.data) == 2:
-                        data = obj.data[:,lower_index:upper_index]
-                    elif np.ndim(obj.data) == 3:
-                        data = obj.data[:,lower_index:upper_index,:]
-                    trials[trial][obj_type].append(self.container_factory(style=obj_type, data=data))
-                    trials[trial][obj_type][-1].nD_labels['1D'] = obj.nD_labels['1D']
-                    trials[trial][obj_type][-1].nD_labels['2D'] = obj.nD_labels['2D'][lower_index:upper_index]
-                    
-                    prev_len = upper_index-lower_index
-
-        self.trials = trials
+    def makeROIs(self, form=None):
+        times = np.asarray(self.events[self.metadata['event_of_interest']])
+        bounds = self.metadata['roi_bounds']
+
+        if form:
+            # Compute the features of each Cont around the events only
+            self.trials = {'Conts': [trials.from_events(cont, times, bounds, form, self.metadata) for cont in self.conts],
+                            'Bins': [trials.from_container(binary, times, bounds, self.metadata) for binary in self.bins]}
+            return
+
+        # One contiguous Trials x Channels x Time (x Freq) array per container
+        self.trials = {'Conts': [trials.from_container(cont, times, bounds, self.metadata) for cont in self.conts],
+                        'Bins': [trials.from_container(binary, times, bounds, self.metadata) for binary in self.bins]}
+
+        if self.metadata.get('norm') and self.metadata['norm_method'] == 'BASELINE':
+            for cont_trials in self.trials['Conts']:
+                normalization.baseline(cont_trials.data, cont_trials.nD_labels['2D'],
+                                        self.metadata.get('baseline_bounds', (bounds[0], 0)), axis=2)
+
+
+    def slidingWindows(self, style='Conts', index=0, batch_size=None):
+        '''
+        Yield (times, windows) for batches of overlapping windows across the whole duration.
+
+        Windows last window_length seconds and start every window_step seconds.
+        They are strided views of the container data where possible, and only
+        one batch is held in memory at a time.
+        '''
+        container = {'Conts': self.conts, 'Bins': self.bins}[style][index]
+        labels = container.nD_labels['2D']
+        period = labels[1] - labels[0]
+        length = int(round(self.metadata['window_length'] / period))
+        step = max(int(round(self.metadata.get('window_step', self.metadata['window_length']) / period)), 1)
+        if batch_size is None:
+            batch_size = self.metadata.get('batch_size', 1024)
 
+        for starts, windows in epochs.batches(container.data, length, step, batch_size):
+            yield labels[starts], windows # Windows x Channels x Time (x Freq)
 
     def container_factory(self,style=None, data = [], timestamps = [], channel_labels = []):
         if style == "Bins":
@@ -5,13 +5,19 @@ It is the container for the :class:`Duration` class.
 '''
 import os
 import datetime
-import neo
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from multiprocessing import shared_memory # Python 3.8+
+except ImportError:
+    shared_memory = None
 import pickle
 from engram.declarative.duration import Duration
-from engram.procedural import events, filters, train
-from engram.episodic import envs
+from engram.declarative.cont import Cont
+from engram.declarative.lazy import LazyData, discard, scratch_memmap
+from engram.declarative import store, cache
+from engram.procedural import events, filters
 import numpy as np
-from scipy.io import loadmat
 
 
 class ID(object):
@@ -39,44 +45,227 @@ class ID(object):
         self.durations.append(Duration(self.id, bins, bin_channels, bin_timestamps, conts, cont_channels, events, labels, self.metadata))
    
     def model(self, method='channels', model_type='CNN'):
-        train.train(model_type, self.trial_features, self.trial_labels)
-
-    def save(self, datadir='users'):
-        if not os.path.exists(datadir):
-            os.mkdir(datadir)
-        filename = os.path.join(datadir, f"{self.id}")
-        with open(filename, "wb") as fp:
-            pickle.dump(self, fp)
+        # Trials of the first container of the chosen feature, across every duration
+        style = 'Bins' if self.metadata.get('feature') == 'spikes' else 'Conts'
+        features = [duration.trials[style][0].data for duration in self.durations] # Streamed, not concatenated
+        labels = {category: np.concatenate([duration.trial_labels[category] for duration in self.durations])
+                    for category in self.durations[0].trial_labels}
+        from engram.procedural import train # Imports TensorFlow
+        train.train(model_type, features, labels, batch_size=self.metadata.get('training_batch_size', 32))
+
+    def crossValidate(self, decoder, params=None, method='kfold', k=5, processes=None):
+        '''
+        Score a decoder on k folds of the trials ('kfold') or holding out each duration ('session').
+
+        The decoder is a name from :mod:`engram.procedural.decoders` (e.g. 'LDA')
+        or a class with fit and predict. Folds run on processes workers, each
+        limited to the 'workers' threads.
+        '''
+        if processes is None:
+            processes = self.metadata.get('processes', 1)
+        style = 'Bins' if self.metadata.get('feature') == 'spikes' else 'Conts'
+        features = [duration.trials[style][0].data for duration in self.durations]
+        labels = {category: np.concatenate([duration.trial_labels[category] for duration in self.durations])
+                    for category in self.durations[0].trial_labels}
+        from engram.procedural import crossval # Imports the decoders
+        if method == 'kfold':
+            folds = crossval.kfold(sum(len(session) for session in features), k=k)
+        elif method == 'session':
+            folds = crossval.leave_one_session_out(features)
+        else:
+            raise Exception("Unrecognized cross-validation method.")
+        return crossval.run(features, labels, folds, decoder, params=params, processes=processes,
+                            threads=self.metadata.get('workers', 1), scratch_dir=self.metadata.get('scratch_dir'))
+
+    def save(self, datadir='users', compress=False):
+        store.save(self, datadir=datadir, compress=compress)
         print(self.id + " saved!")
 
-    def load(self, metadata=None, datadir='users'):
+    def load(self, metadata=None, datadir='users', durations=None, channels=None, mmap=True):
         filename = os.path.join(datadir, f"{self.metadata['name']}")
-        loadedID = pickle.load(open(filename, "rb"))
+        if os.path.isfile(filename):
+            # Sessions saved before the directory store were pickled
+            loadedID = pickle.load(open(filename, "rb"))
+        else:
+            loadedID = store.load(self.metadata['name'], datadir=datadir, durations=durations,
+                                    channels=channels, mmap=mmap)
         print(loadedID.id + " loaded!")
 
         return loadedID
 
-    def standardize(self,form='stft'):
+    def standardize(self,form='stft',processes=None):
+        cachedir = self.metadata.get('cache_dir')
+        if processes is None:
+            processes = self.metadata.get('processes', 1)
+
+        pending = []
         for ii,duration in enumerate(self.durations):
 
             # Derive Features from Each Trace
             for jj, cont in enumerate(duration.conts):
 
-                if 'stft' in form:
-                    self.durations[ii].conts[jj] = cont.stft()
-                
-                if 'lfp' in form:
-                    self.durations[ii].conts[jj] = cont.stft()
+                # Reuse features derived from the same data and parameters
+                cache_key = None
+                if cachedir:
+                    cache_key = cache.key(cont, form)
+                    if cache.load(cache_key, cont, cachedir):
+                        print('Loaded cached features for ' + self.id)
+                        continue
+
+                pending.append((ii, jj, cache_key))
 
             for jj, binary in enumerate(duration.bins):
                 if 'bspline' in form:
+                    self.durations[ii].bins[jj] = binary.bspline()
+
+        if processes > 1 and len(pending) > 1:
+            standardize_parallel(self, form, [(ii, jj) for ii, jj, _ in pending], processes)
+        else:
+            for ii, jj, _ in pending:
+                cont = self.durations[ii].conts[jj]
+
+                if 'stft' in form:
                     self.durations[ii].conts[jj] = cont.stft()
+                
+                if 'lfp' in form:
+                    self.durations[ii].conts[jj] = cont.lfp()
 
+        if cachedir:
+            for ii, jj, cache_key in pending:
+                cache.save(cache_key, self.durations[ii].conts[jj], cachedir,
+                            self.metadata.get('cache_size', cache.CACHE_SIZE))
     
     
-    def extractTrials(self):
+    def extractTrials(self, form=None):
+        '''
+        Cut the trials around each event out of every duration.
+
+        With a form ('stft' or 'lfp'), features are computed from the raw
+        Conts around each event only, instead of standardizing whole
+        recordings first.
+        '''
         for ii,duration in enumerate(self.durations):
-            duration.makeROIs()
+            duration.makeROIs(form=form)
 
     def episode(self, shader='engram'):
+        from engram.episodic import envs # Imports vispy
         envs.select(shader=shader,id=self)
+
+
+
+def standardize_parallel(id, form, indices, processes):
+    '''
+    Standardize the Conts at the given (duration, cont) indices on a process pool.
+
+    Lazy and memory-mapped data is passed by reference, data that is not
+    already backed by a file is placed in shared memory (or, before Python
+    3.8, in a memory-mapped scratch file), and workers write their output to
+    memory-mapped files, so no large array is copied between processes.
+    '''
+    blocks = {}
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            jobs = {}
+            for ii, jj in indices:
+                cont = id.durations[ii].conts[jj]
+                # Workers read lazy and memory-mapped samples from the same source
+                data = cont.data if isinstance(cont.data, LazyData) else mapping(cont.data)
+                if data is None and shared_memory is None:
+                    # Move the samples into a scratch file that workers map
+                    array = np.asarray(cont.data)
+                    cont.data = scratch_memmap(array.shape, array.dtype, cont.metadata.get('scratch_dir'), shared=True)
+                    cont.data[...] = array
+                    cont.data.flush()
+                    del array
+                    blocks[(ii, jj)] = cont.data
+                    data = mapping(cont.data)
+                elif data is None:
+                    # Move the samples into shared memory and drop the private copy
+                    array = np.asarray(cont.data)
+                    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                    blocks[(ii, jj)] = block
+                    cont.data = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+                    cont.data[...] = array
+                    del array
+                    data = {'name': block.name, 'shape': cont.data.shape, 'dtype': str(cont.data.dtype)}
+
+                job = {'id': cont.id, 'data': data, 'timestamps': cont.timestamps,
+                        'channel_labels': cont.nD_labels['1D'], 'metadata': cont.metadata, 'form': form}
+                jobs[(ii, jj)] = executor.submit(standardize_worker, job)
+
+            for (ii, jj), future in jobs.items():
+                filename, nD_labels, fs = future.result()
+                cont = id.durations[ii].conts[jj]
+                cont.data = np.load(filename, mmap_mode='c')
+                discard(cont.data)
+                cont.nD_labels = nD_labels
+                if fs != cont.metadata['fs']:
+                    cont.metadata = dict(cont.metadata, fs=fs) # Resampled
+                release(blocks.pop((ii, jj), None))
+    finally:
+        # Conts left unstandardized by a failure get their samples back before the blocks are freed
+        for (ii, jj), block in blocks.items():
+            cont = id.durations[ii].conts[jj]
+            cont.data = np.array(cont.data)
+            release(block)
+
+
+def mapping(data):
+    '''
+    Where workers can map the same samples as a memory-mapped array, or None.
+
+    Only whole mappings are shared, and not copy-on-write ones, whose
+    samples may differ from those in the file.
+    '''
+    if not isinstance(data, np.memmap) or not isinstance(data.base, mmap.mmap) or data.mode == 'c' \
+            or not data.filename or not (data.flags.c_contiguous or data.flags.f_contiguous):
+        return None
+    if data.mode != 'r':
+        data.flush()
+    return {'filename': data.filename, 'offset': data.offset, 'shape': data.shape, 'dtype': data.dtype,
+            'order': 'C' if data.flags.c_contiguous else 'F'}
+
+
+def release(block):
+    '''Free the shared memory block (or scratch file) that carried a Cont to the workers.'''
+    if block is None:
+        return
+    if isinstance(block, np.memmap):
+        discard(block)
+    else:
+        block.close()
+        block.unlink()
+
+
+def standardize_worker(job):
+    block = None
+    data = job['data']
+    if isinstance(data, dict) and 'filename' in data:
+        data = np.memmap(data['filename'], mode='r', dtype=data['dtype'], shape=data['shape'],
+                            offset=data['offset'], order=data['order'])
+    elif isinstance(data, dict):
+        block = shared_memory.SharedMemory(name=data['name']) # The parent owns and unlinks the block
+        data = np.ndarray(data['shape'], dtype=data['dtype'], buffer=block.buf)
+
+    # Run exactly the same steps as the serial path
+    cont = Cont(job['id'], data=data, timestamps=job['timestamps'],
+                channel_labels=job['channel_labels'], metadata=job['metadata'])
+    del data
+    if 'stft' in job['form']:
+        cont = cont.stft()
+    if 'lfp' in job['form']:
+        cont = cont.lfp()
+
+    out = scratch_memmap(np.shape(cont.data), cont.data.dtype, job['metadata'].get('scratch_dir'), shared=True)
+    out[...] = cont.data
+    out.flush()
+    filename = out.filename
+    del out
+    nD_labels = cont.nD_labels
+    fs = cont.metadata['fs']
+
+    del cont
+    if block is not None:
+        block.close()
+
+    return filename, nD_labels, fs
@@ -0,0 +1,247 @@
+'''
+This module defines :class:`LazyData`, a Channels x Time array that only loads
+the samples that are indexed, along with the sources it can be backed by.
+'''
+
+import os
+import tempfile
+import weakref
+import numpy as np
+
+
+class LazyData(object):
+
+    '''
+    Channels x Time array whose samples are read from their source on indexing.
+
+    Subclasses implement :meth:`_load`, which returns the requested channels
+    between two sample indices as an ndarray. Channel and time indices are
+    applied independently of each other (orthogonal indexing).
+    '''
+
+    def __init__(self, shape, dtype='float64'):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    def __repr__(self):
+        return "{}(shape={}, dtype={})".format(type(self).__name__, self.shape, self.dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __array__(self, dtype=None, copy=None):
+        data = self._load(np.arange(self.shape[0]), 0, self.shape[1])
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        channel_key = key[0]
+        if len(key) > 2:
+            raise IndexError('too many indices for a Channels x Time array')
+        time_key = key[1] if len(key) > 1 else slice(None)
+
+        # Resolve channels
+        channels = np.arange(self.shape[0])[channel_key]
+        squeeze_channels = np.ndim(channels) == 0
+        channels = np.atleast_1d(channels)
+
+        # Resolve the smallest contiguous run of samples to read
+        if isinstance(time_key, slice) and time_key.step in (None, 1):
+            start, stop, _ = time_key.indices(self.shape[1])
+            stop = max(start, stop)
+            local_key = slice(None)
+        else:
+            samples = np.arange(self.shape[1])[time_key]
+            if np.size(samples) == 0:
+                start, stop = 0, 0
+            else:
+                start, stop = int(np.min(samples)), int(np.max(samples)) + 1
+            local_key = samples - start
+
+        data = self._load(channels, start, stop)[:, local_key]
+        if squeeze_channels:
+            data = data[0]
+        return data
+
+    def _load(self, channels, i_start, i_stop):
+        raise NotImplementedError
+
+
+class ReaderData(LazyData):
+
+    '''
+    Lazy signals read through a Neo RawIO reader.
+    '''
+
+    def __init__(self, reader, channel_indexes=None, dtype='float64'):
+        self.reader = reader
+        if channel_indexes is None:
+            channel_indexes = np.arange(len(reader.header['signal_channels']))
+        self.channel_indexes = np.asarray(channel_indexes)
+        n_samples = reader.get_signal_size(block_index=0, seg_index=0)
+        LazyData.__init__(self, (len(self.channel_indexes), n_samples), dtype)
+
+    def _load(self, channels, i_start, i_stop):
+        channel_indexes = self.channel_indexes[channels]
+        raw_sigs = self.reader.get_analogsignal_chunk(block_index=0, seg_index=0,
+                                                    i_start=i_start, i_stop=i_stop,
+                                                    channel_indexes=channel_indexes)
+        float_sigs = self.reader.rescale_signal_raw_to_float(raw_sigs, dtype=self.dtype,
+                                                            channel_indexes=channel_indexes)
+        return float_sigs.T
+
+
+class FileData(LazyData):
+
+    '''
+    Lazy signals memory-mapped from a Channels x Time .npy file.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._memmap = np.load(filename, mmap_mode='r')
+        LazyData.__init__(self, self._memmap.shape, self._memmap.dtype)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_memmap']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memmap = np.load(self.filename, mmap_mode='r')
+
+    def _load(self, channels, i_start, i_stop):
+        if len(channels) == self.shape[0] and (channels == np.arange(self.shape[0])).all():
+            return np.array(self._memmap[:, i_start:i_stop])
+        return self._memmap[channels, i_start:i_stop]
+
+
+class ChunkedData(LazyData):
+
+    '''
+    Lazy signals stored as a directory of Channels x Time chunk files.
+
+    Each chunk holds ``chunk_size`` samples of every channel, saved as .npy
+    (memory-mapped on read) or compressed .npz. Only the chunks overlapping an
+    indexed window are read. ``channels`` restricts the array to a subset of
+    the stored rows.
+    '''
+
+    def __init__(self, directory, shape, dtype, chunk_size, compressed=False, channels=None):
+        self.directory = directory
+        self.chunk_size = int(chunk_size)
+        self.compressed = compressed
+        self.stored_shape = tuple(shape)
+        if channels is None:
+            channels = np.arange(shape[0])
+        self.channels = np.asarray(channels)
+        LazyData.__init__(self, (len(self.channels), shape[1]), dtype)
+
+    def chunk(self, index):
+        if self.compressed:
+            with np.load(chunk_filename(self.directory, index, True)) as archive:
+                return archive['data']
+        return np.load(chunk_filename(self.directory, index, False), mmap_mode='r')
+
+    def _load(self, channels, i_start, i_stop):
+        rows = self.channels[channels]
+        data = np.empty((len(rows), i_stop - i_start), dtype=self.dtype)
+        first = i_start // self.chunk_size
+        last = -(-i_stop // self.chunk_size)
+        for index in range(first, last):
+            offset = index * self.chunk_size
+            lower = max(i_start, offset)
+            upper = min(i_stop, offset + self.chunk_size)
+            data[:, lower-i_start:upper-i_start] = self.chunk(index)[rows, lower-offset:upper-offset]
+        return data
+
+
+class ScaledData(LazyData):
+
+    '''
+    Lazy signals rescaled from a raw (typically int16) Channels x Time array.
+
+    The raw samples stay in their native type, memory-mapped or lazy, and
+    each indexed window is converted as ``raw * gain + offset`` with the
+    per-channel gain and offset reported by the acquisition system.
+    '''
+
+    def __init__(self, raw, gain, offset, dtype='float64'):
+        self.raw = raw
+        self.gain = np.broadcast_to(np.asarray(gain, dtype=dtype), (raw.shape[0],)).copy()
+        self.offset = np.broadcast_to(np.asarray(offset, dtype=dtype), (raw.shape[0],)).copy()
+        LazyData.__init__(self, raw.shape, dtype)
+
+    def subset(self, rows):
+        '''
+        The same signals restricted to the given channels, without reading them.
+        '''
+        if isinstance(self.raw, ChunkedData):
+            raw = ChunkedData(self.raw.directory, self.raw.stored_shape, self.raw.dtype,
+                                self.raw.chunk_size, self.raw.compressed, channels=self.raw.channels[rows])
+        else:
+            raw = self.raw[rows]
+        return ScaledData(raw, self.gain[rows], self.offset[rows], self.dtype)
+
+    def _load(self, channels, i_start, i_stop):
+        if len(channels) == self.shape[0] and (channels == np.arange(self.shape[0])).all():
+            raw = self.raw[:, i_start:i_stop]
+        else:
+            raw = self.raw[channels, i_start:i_stop]
+        data = np.asarray(raw).astype(self.dtype)
+        data *= self.gain[channels, None]
+        data += self.offset[channels, None]
+        return data
+
+
+def chunk_filename(directory, index, compressed=False):
+    return os.path.join(directory, '{:05d}.{}'.format(index, 'npz' if compressed else 'npy'))
+
+
+def scratch_memmap(shape, dtype, scratch_dir=None, shared=False):
+    '''
+    Writable memory map of a new .npy file in the scratch directory (the system's if None).
+
+    The file is removed once it is no longer needed (see :func:`discard`).
+    With shared, it is kept so other processes can map its ``filename``
+    until it is discarded.
+    '''
+    fd, filename = tempfile.mkstemp(suffix='.npy', dir=scratch_dir)
+    os.close(fd)
+    out = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=tuple(shape))
+    if not shared:
+        discard(out)
+    return out
+
+
+def discard(mapping):
+    '''
+    Remove the file behind a memory map, which stays usable.
+
+    The file is removed right away where open files can be removed, and
+    otherwise (on Windows) as soon as the mapping is closed.
+    '''
+    try:
+        os.remove(mapping.filename)
+    except OSError:
+        handle = mapping._mmap if getattr(mapping, '_mmap', None) is not None else mapping
+        weakref.finalize(handle, remove, mapping.filename)
+
+
+def remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
@@ -0,0 +1,261 @@
+'''
+This module saves and loads :class:`ID` objects as a directory of arrays.
+
+Each session is written to ``<datadir>/<name>/`` with one file per array and a
+``manifest.json`` describing the object graph, metadata, events and labels.
+Channels x Time container data is split into chunks along time, optionally
+compressed. On load, arrays are memory-mapped and chunked data is only read
+when indexed, so opening a session does not read its samples.
+'''
+
+import os
+import json
+import pickle
+import shutil
+import numpy as np
+from scipy import sparse
+from engram.declarative.lazy import ChunkedData, ScaledData, chunk_filename
+
+MANIFEST = 'manifest.json'
+CHUNK_SIZE = 2**16 # Samples per channel in each chunk file
+MMAP_SIZE = 2**20 # Smaller arrays are read into memory
+
+
+def save(id, datadir='users', compress=False, chunk_size=CHUNK_SIZE):
+    directory = os.path.join(datadir, f"{id.id}")
+    if os.path.isfile(directory):
+        os.remove(directory) # Replace a pickled session of the same name
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    options = {'directory': directory, 'compress': compress, 'chunk_size': chunk_size,
+                'metadata': id.metadata, 'written': set()}
+    manifest = encode(id, 'id', options)
+
+    # Remove arrays left over from a previous save
+    for root, _, files in os.walk(directory):
+        for name in files:
+            relpath = os.path.relpath(os.path.join(root, name), directory)
+            if relpath != MANIFEST and relpath not in options['written']:
+                os.remove(os.path.join(root, name))
+
+    filename = os.path.join(directory, MANIFEST)
+    with open(filename + '.tmp', 'w') as fp:
+        json.dump(manifest, fp, indent=1)
+    os.replace(filename + '.tmp', filename)
+
+
+def load(name, datadir='users', durations=None, channels=None, mmap=True):
+    '''
+    Load a saved session.
+
+    Args:
+        durations: indices of the durations to load (all if None)
+        channels: channel labels to keep in every container (all if None)
+        mmap: memory-map arrays instead of reading them into memory
+    '''
+    directory = os.path.join(datadir, f"{name}")
+    with open(os.path.join(directory, MANIFEST), 'r') as fp:
+        manifest = json.load(fp)
+
+    if durations is not None:
+        entries = manifest['attributes']['durations']['__list__']
+        manifest['attributes']['durations']['__list__'] = [entries[ii] for ii in durations]
+
+    options = {'directory': directory, 'mmap': mmap, 'metadata': None}
+    options['metadata'] = decode(manifest['attributes'].pop('metadata'), options)
+    id = decode(manifest, options)
+    id.metadata = options['metadata']
+
+    if channels is not None:
+        for duration in id.durations:
+            for container in duration.conts + duration.bins:
+                select_channels(container, channels)
+
+    return id
+
+
+def select_channels(container, channels):
+    rows = np.where(np.isin(container.nD_labels['1D'], channels))[0]
+    if isinstance(container.timestamps, list) and len(container.timestamps) == len(container.nD_labels['1D']):
+        container.timestamps = [container.timestamps[row] for row in rows] # Spike times per unit
+    container.nD_labels['1D'] = container.nD_labels['1D'][rows]
+    if isinstance(container.data, ScaledData):
+        container.data = container.data.subset(rows)
+    elif isinstance(container.data, ChunkedData):
+        data = container.data
+        container.data = ChunkedData(data.directory, data.stored_shape, data.dtype, data.chunk_size,
+                                    data.compressed, channels=data.channels[rows])
+    elif np.ndim(container.data) >= 2:
+        container.data = container.data[rows]
+
+
+# Encoding
+
+def encode(value, path, options):
+    from engram.declarative import class_by_name
+
+    if value is options['metadata'] and path != 'id/metadata':
+        return {'__metadata__': True} # Shared with the ID
+    if type(value).__name__ in class_by_name:
+        return {'__class__': type(value).__name__,
+                'attributes': {key: encode(attribute, f"{path}/{key}", options)
+                                for key, attribute in value.__dict__.items()}}
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value):
+            return {'__dict__': {key: encode(item, f"{path}/{key}", options)
+                                    for key, item in value.items()}}
+        return {'__items__': [[encode(key, f"{path}/{ii}_key", options),
+                                encode(item, f"{path}/{ii}", options)]
+                                for ii, (key, item) in enumerate(value.items())]}
+    if isinstance(value, (list, tuple, range)):
+        if all(isinstance(item, np.ndarray) for item in value) and len(value) > 0 \
+                and all(np.ndim(item) == 1 for item in value):
+            return encode_ragged(value, path, options)
+        return {'__list__': [encode(item, f"{path}/{ii}", options)
+                                for ii, item in enumerate(value)]}
+    if isinstance(value, ChunkedData):
+        return encode_chunked(value, path, options)
+    if isinstance(value, ScaledData):
+        # Keep the raw samples in their native type
+        return {'__scaled__': {'raw': encode_chunked(value.raw, f"{path}/raw", options),
+                                'gain': value.gain.tolist(), 'offset': value.offset.tolist(),
+                                'dtype': str(value.dtype)}}
+    if sparse.issparse(value):
+        value = sparse.csr_matrix(value)
+        return {'__sparse__': {'data': encode_array(value.data, f"{path}/data", options),
+                                'indices': encode_array(value.indices, f"{path}/indices", options),
+                                'indptr': encode_array(value.indptr, f"{path}/indptr", options),
+                                'shape': list(value.shape)}}
+    if hasattr(value, 'shape') and hasattr(value, 'dtype'):
+        if path.endswith('/data') and len(value.shape) == 2 and value.dtype != object:
+            return encode_chunked(value, path, options)
+        return encode_array(np.asarray(value), path, options)
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return encode_pickle(value, path, options)
+
+
+def encode_array(array, path, options):
+    if array.dtype == object:
+        return encode_pickle(array, path, options)
+    relpath = path + '.npy'
+    write(os.path.join(options['directory'], relpath), lambda fp: np.save(fp, array))
+    options['written'].add(relpath)
+    return {'__ndarray__': relpath}
+
+
+def encode_ragged(arrays, path, options):
+    offsets = np.concatenate(([0], np.cumsum([len(array) for array in arrays])))
+    return {'__ragged__': {'values': encode_array(np.concatenate(arrays), f"{path}/values", options),
+                            'offsets': encode_array(offsets, f"{path}/offsets", options)}}
+
+
+def encode_chunked(data, path, options):
+    directory = os.path.join(options['directory'], path)
+    compressed = options['compress']
+    chunk_size = options['chunk_size']
+    n_chunks = -(-data.shape[1] // chunk_size)
+    relpaths = [os.path.relpath(chunk_filename(directory, index, compressed), options['directory'])
+                    for index in range(n_chunks)]
+
+    # Chunks already stored at this location are left untouched
+    reading = isinstance(data, ChunkedData) and os.path.abspath(data.directory) == os.path.abspath(directory)
+    unchanged = reading and np.array_equal(data.channels, np.arange(data.stored_shape[0])) \
+                    and data.compressed == compressed and data.chunk_size == chunk_size
+    if not unchanged:
+        # Chunks read from this location are rewritten next to it and swapped in once complete
+        target = directory + '.tmp' if reading else directory
+        if reading and os.path.exists(target):
+            shutil.rmtree(target) # Left by an interrupted save
+        if not os.path.exists(target):
+            os.makedirs(target)
+        for index in range(n_chunks):
+            chunk = np.asarray(data[:, index*chunk_size:(index+1)*chunk_size])
+            filename = chunk_filename(target, index, compressed)
+            if compressed:
+                write(filename, lambda fp: np.savez_compressed(fp, data=chunk))
+            else:
+                write(filename, lambda fp: np.save(fp, chunk))
+        if reading:
+            shutil.rmtree(directory)
+            os.rename(target, directory)
+            # The source now reads the new chunks
+            data.stored_shape = data.shape
+            data.channels = np.arange(data.shape[0])
+            data.chunk_size = chunk_size
+            data.compressed = compressed
+    options['written'].update(relpaths)
+
+    return {'__chunked__': {'path': path, 'shape': list(data.shape), 'dtype': str(np.dtype(data.dtype)),
+                            'chunk_size': chunk_size, 'compressed': compressed}}
+
+
+def encode_pickle(value, path, options):
+    relpath = path + '.pkl'
+    write(os.path.join(options['directory'], relpath), lambda fp: pickle.dump(value, fp))
+    options['written'].add(relpath)
+    return {'__pickle__': relpath}
+
+
+def write(filename, writer):
+    # Write next to the target and swap it in, which is safe for memory-mapped readers
+    directory = os.path.dirname(filename)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(filename + '.tmp', 'wb') as fp:
+        writer(fp)
+    os.replace(filename + '.tmp', filename)
+
+
+# Decoding
+
+def decode(value, options):
+    from engram.declarative import class_by_name
+
+    if not isinstance(value, (dict, list)):
+        return value
+    if isinstance(value, list):
+        return [decode(item, options) for item in value]
+    if '__metadata__' in value:
+        return options['metadata']
+    if '__class__' in value:
+        obj = class_by_name[value['__class__']].__new__(class_by_name[value['__class__']])
+        for key, attribute in value['attributes'].items():
+            setattr(obj, key, decode(attribute, options))
+        return obj
+    if '__dict__' in value:
+        return {key: decode(item, options) for key, item in value['__dict__'].items()}
+    if '__items__' in value:
+        return {decode(key, options): decode(item, options) for key, item in value['__items__']}
+    if '__list__' in value:
+        return [decode(item, options) for item in value['__list__']]
+    if '__ragged__' in value:
+        values = decode(value['__ragged__']['values'], options)
+        offsets = decode(value['__ragged__']['offsets'], options)
+        return [np.asarray(values[offsets[ii]:offsets[ii+1]]) for ii in range(len(offsets)-1)]
+    if '__sparse__' in value:
+        entry = value['__sparse__']
+        return sparse.csr_matrix((decode(entry['data'], options), decode(entry['indices'], options),
+                                    decode(entry['indptr'], options)), shape=tuple(entry['shape']))
+    if '__scaled__' in value:
+        entry = value['__scaled__']
+        return ScaledData(decode(entry['raw'], options), entry['gain'], entry['offset'], entry['dtype'])
+    if '__chunked__' in value:
+        entry = value['__chunked__']
+        data = ChunkedData(os.path.join(options['directory'], entry['path']), entry['shape'],
+                            entry['dtype'], entry['chunk_size'], entry['compressed'])
+        if not options['mmap']:
+            return np.asarray(data)
+        return data
+    if '__ndarray__' in value:
+        filename = os.path.join(options['directory'], value['__ndarray__'])
+        if options['mmap'] and os.path.getsize(filename) > MMAP_SIZE:
+            return np.load(filename, mmap_mode='c')
+        return np.load(filename)
+    if '__pickle__' in value:
+        with open(os.path.join(options['directory'], value['__pickle__']), 'rb') as fp:
+            return pickle.load(fp)
+    return value
@@ -0,0 +1,141 @@
+'''
+This module defines :class:`Trials`,  a container for windows of data around events.
+'''
+from math import gcd
+from engram.declarative.lazy import scratch_memmap
+from engram.procedural import epochs, filters, normalization, resampling, spectral
+
+import numpy as np
+from scipy import sparse
+
+class Trials(object):
+    def __init__(self, id, data=[], times=[], channel_labels=[], time_labels=[], \
+                freq_labels=None, metadata=None):
+
+        self.id = id
+        self.data = data # Trials x Channels x Time (x Freq)
+        self.times = np.asarray(times) # Event time of each trial
+        self.metadata = metadata
+
+        self.nD_labels = {}
+        self.nD_labels['1D'] = np.asarray(channel_labels)
+        self.nD_labels['2D'] = np.asarray(time_labels) # Relative to the event
+        self.nD_labels['3D'] = freq_labels
+
+    def __repr__(self):
+        return "Trials('{}',{})".format(self.id, np.shape(self.data))
+
+    def __str__(self):
+        return '{} _ {} trials'.format(self.id, len(self))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+
+def from_container(container, times, bounds, metadata):
+    '''
+    Stack the windows of a Cont or Bin around each event time into :class:`Trials`.
+
+    The trials are memory-mapped into the scratch directory when the
+    session is processed out of core (``chunk_size`` is set).
+    '''
+    times = np.asarray(times, dtype=float)
+    labels = container.nD_labels['2D']
+    starts, length = epochs.locate(labels, times, bounds)
+
+    data = container.data
+    shape = (len(starts),) + tuple(data.shape[:1]) + (length,) + tuple(data.shape[2:])
+    dtype = data.dtype if not sparse.issparse(data) and data.dtype.kind == 'f' \
+                else np.dtype(metadata.get('dtype', 'float64'))
+    if metadata.get('chunk_size'):
+        out = scratch_memmap(shape, dtype, metadata.get('scratch_dir'))
+    else:
+        out = np.empty(shape, dtype=dtype)
+    epochs.stack(data, starts, length, out=out)
+
+    relative = labels[starts[0]:starts[0]+length] - times[0] if len(times) else labels[:0]
+    return Trials(container.id, data=out, times=times, channel_labels=container.nD_labels['1D'],
+                    time_labels=relative, freq_labels=container.nD_labels['3D'], metadata=metadata)
+
+
+def from_events(cont, times, bounds, form, metadata):
+    '''
+    Compute the features of a Cont around each event only and stack them into :class:`Trials`.
+
+    Each window is read with a margin for the filter (and resampler) to
+    settle, aligned so its samples and spectrogram frames fall on the same
+    grid as those of the whole recording. Features therefore match
+    ``Cont.stft``/``Cont.lfp`` followed by :func:`from_container`, while the
+    samples outside the windows are never read or transformed. Z-scores are
+    computed over the trial windows rather than the whole recording.
+    '''
+    times = np.asarray(times, dtype=float)
+    fs = metadata['fs']
+    dtype = metadata.get('dtype', 'float64')
+    workers = metadata.get('workers', 1)
+    n_samples = cont.data.shape[1]
+    sos = filters.butter_sos(metadata['bandpass_min'], metadata['bandpass_max'], fs, order=5)
+    margin = filters.settling_samples(sos, tol=metadata.get('settling_tol', 1e-3))
+
+    up, down = 1, 1
+    if metadata.get('lfp_fs') and metadata['lfp_fs'] < fs:
+        up, down = resampling.ratio(fs, metadata['lfp_fs'])
+        margin += len(resampling.anti_alias(up, down)) // up + 1
+    new_fs = fs * up / float(down)
+    n_new = -(-n_samples * up // down)
+
+    # Locate the trials on the frames (or samples) the whole recording would have
+    origin = cont.nD_labels['2D'][0] if len(cont.nD_labels['2D']) else 0
+    if 'stft' in form:
+        nperseg = int(metadata['t_bin'] * new_fs)
+        step, _, labels = spectral.frames(n_new, new_fs, nperseg)
+        span = nperseg
+    else:
+        step, span = 1, 1
+        labels = np.arange(n_new) / new_fs
+    starts, length = epochs.locate(labels + origin, times, bounds)
+
+    # Read each window with its margin, starting on a sample that maps onto the frame grid
+    quantum = down * step // gcd(up, step)
+    lower = (np.floor((starts * step * down / float(up) - margin) / quantum) * quantum).astype('int')
+    n_read = int(np.ceil((((length - 1) * step + span) * down / float(up) + 2 * margin) / quantum + 1) * quantum)
+    windows = np.empty((len(starts), cont.data.shape[0], n_read), dtype=dtype)
+    for trial, first in enumerate(lower):
+        block = np.asarray(cont.data[:, max(first, 0):min(first + n_read, n_samples)], dtype=dtype)
+        windows[trial] = np.pad(block, ((0, 0), (max(-first, 0), max(first + n_read - n_samples, 0))), mode='edge')
+
+    windows = filters.sos_filter(windows, sos, axis=-1, workers=workers, dtype=dtype)
+    if (up, down) != (1, 1):
+        windows, _ = resampling.resample(windows, fs, new_fs, dtype=dtype)
+    f = None
+    if 'stft' in form:
+        f, _, windows = spectral.spectrogram(windows, new_fs, nperseg, fmin=metadata['2D_min'],
+                                                fmax=metadata['2D_max'], workers=workers,
+                                                dtype=dtype) # Trials x Channels x Time x Freq
+
+    # Cut the frames of each trial out of its window
+    offsets = (starts * step - lower * up // down) // step
+    data = np.empty(windows.shape[:2] + (length,) + windows.shape[3:], dtype=dtype)
+    for trial, offset in enumerate(offsets):
+        data[trial] = windows[trial, :, offset:offset+length]
+    del windows
+
+    relative = labels[starts[0]:starts[0]+length] + origin - times[0] if len(times) else labels[:0]
+    if 'stft' in form and metadata['norm']:
+        if metadata['log_transform']:
+            normalization.log_transform(data)
+        if metadata['norm_method'] == 'ZSCORE':
+            # Statistics over every trial window, accumulated trial by trial
+            stats = normalization.RunningStats(axis=1)
+            for trial in data:
+                stats.update(trial)
+            for trial in data:
+                stats.apply(trial, out=trial)
+        elif metadata['norm_method'] == 'BASELINE':
+            normalization.baseline(data, relative, metadata.get('baseline_bounds', (bounds[0], 0)), axis=2)
+
+    return Trials(cont.id, data=data, times=times, channel_labels=cont.nD_labels['1D'],
+                    time_labels=relative, freq_labels=f, metadata=metadata)
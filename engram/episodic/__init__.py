@@ -1,6 +1,20 @@
 # -*- coding:utf-8 -*-
 '''
 :mod:'engram.episodic' provides functions for visualizing Engrams
+
+Submodules are imported when first used, so vispy is only loaded to visualize.
 '''
 
-from . import (envs)
\ No newline at end of file
+import importlib
+
+__all__ = ['envs']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
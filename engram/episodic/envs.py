@@ -25,6 +25,7 @@ def select(shader="engramv1",id=None):
 def engramv1(id):
     from vispy import app, gloo, visuals
     from vispy.util.transforms import perspective, translate, rotate
+    from engram.procedural import kernels
 
     # ____________________________ DATA ____________________________
 
@@ -85,27 +86,11 @@ def engramv1(id):
     Y = 6*((np.asarray(Y) - min(Y))/(max(Y)-min(Y)) - .5)
     Z = 6*((np.asarray(Z) - min(Z))/(max(Z)-min(Z)) - .5)
 
-    # Convert binary array into visualizable continuous values
+    # Convert binary array into visualizable continuous values, computed as frames are drawn
     TRAIL = 50
-    TIMEPOINTS = 10000000
-    spikes = binary.data.T[0:TIMEPOINTS]
-    one_array = np.where(spikes == 1)
-    if not not one_array:
-        lb_1 = one_array[0]-TRAIL
-        ub_1 = one_array[0]
-        lb_2 = one_array[0]
-        ub_2 = one_array[0]+TRAIL
-        for ii in range(len(lb_1)):
-            if ub_2[ii] > len(spikes):
-                ub_2[ii] = len(spikes)
-            if lb_1[ii] < 0:
-                lb_1[ii] = 0
-                    
-            spikes[lb_1[ii]:ub_1[ii],one_array[1][ii]] += np.linspace(0,1,ub_1[ii]-lb_1[ii])
-            spikes[lb_2[ii]:ub_2[ii],one_array[1][ii]] += np.linspace(1,0,ub_2[ii]-lb_2[ii])
+    spikes = kernels.Activity(binary.data, metadata.get('spike_kernel', 'triangular'), TRAIL,
+                                dtype=metadata.get('dtype', 'float64'))
 
-    
-    
     xyzs = np.zeros((intersection_matrices['sources'].size,4)).astype('float32')
     xyzs[:,0:3] = xyz
     data['a_rotation'] = np.repeat(
@@ -313,6 +298,7 @@ def engram(id):
     from visbrain.objects import RoiObj
     from .objects import SourceObj, ConnectObj
     from visbrain.io import download_file
+    from engram.procedural import kernels
 
     # Create an empty kwargs dictionnary :
     kwargs = {}
@@ -374,24 +360,15 @@ def engram(id):
     # Convert binary array into visualizable continuous values
     print('Calculating spike durations')
     TRAIL = 100
-    TIMEPOINTS = 100000
-    spikes = binary.data.T[0:TIMEPOINTS]
-    one_array = np.where(spikes == 1)
-    if not not one_array:
-        lb_1 = one_array[0]-TRAIL
-        ub_1 = one_array[0]
-        lb_2 = one_array[0]
-        ub_2 = one_array[0]+TRAIL
-        for ii in range(len(lb_1)):
-            if ub_2[ii] > len(spikes):
-                ub_2[ii] = len(spikes)
-            if lb_1[ii] < 0:
-                lb_1[ii] = 0
-                    
-            spikes[lb_1[ii]:ub_1[ii],one_array[1][ii]] += np.linspace(0,1,ub_1[ii]-lb_1[ii])
-            spikes[lb_2[ii]:ub_2[ii],one_array[1][ii]] += np.linspace(1,0,ub_2[ii]-lb_2[ii])
-        
-    spikes = spikes.T
+    TIMEPOINTS = 100000 # Displayed by default (connectivity grows with Electrodes^2 x Time)
+    window = metadata.get('display_window') # In seconds
+    if window is None:
+        start, stop = 0, min(TIMEPOINTS, binary.data.shape[1])
+    else:
+        start = int(window[0] * metadata['fs'])
+        stop = int(window[1] * metadata['fs']) if window[1] is not None else None
+    spikes = kernels.convolve(binary.data, metadata.get('spike_kernel', 'triangular'), TRAIL,
+                                start=start, stop=stop, dtype=metadata.get('dtype', 'float64')) # Units x Time
 
     N = xyz.shape[0]  # Number of electrodes
 
@@ -400,8 +377,8 @@ def engram(id):
                     edge_width=2., radius_min=1., radius_max=25.)
 
     
-    connect = np.zeros((N, N,np.shape(spikes)[1]))
-    valid = np.empty((N, N,np.shape(spikes)[1]))
+    connect = np.zeros((N, N,np.shape(spikes)[1]), dtype=spikes.dtype)
+    valid = np.empty((N, N,np.shape(spikes)[1]), dtype=spikes.dtype)
     edges = np.arange(N)    
 
     print('Calculating connectivity')
@@ -2,6 +2,22 @@
 '''
 :mod:'engram.procedural' provides functions for processing Engram data structures
 and encoding them into models
+
+Submodules are imported when first used, so TensorFlow is only loaded by
+:mod:`engram.procedural.models` and :mod:`engram.procedural.train`.
 '''
 
-from . import (models,train,predict,analyze,events,filters,missingdata)
\ No newline at end of file
+import importlib
+
+__all__ = ['models','train','predict','analyze','crossval','decoders','epochs','events','filters','kernels',
+           'missingdata','normalization','resampling','signals','spectral','splines']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,173 @@
+'''
+Functions to cross-validate decoders over folds of trials on a process pool.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from engram.procedural import decoders, epochs
+import numpy as np
+
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+
+def kfold(n_trials, k=5, shuffle=True, seed=None):
+    """(train, test) indices of k folds that each hold out about n_trials / k trials."""
+    if k < 2 or k > n_trials:
+        raise Exception("The number of folds must be between 2 and the number of trials.")
+    indices = np.arange(n_trials)
+    if shuffle:
+        np.random.default_rng(seed).shuffle(indices)
+    folds = np.array_split(indices, k)
+    return [(np.sort(np.concatenate(folds[:ii] + folds[ii+1:])), np.sort(test))
+                for ii, test in enumerate(folds)]
+
+
+def leave_one_session_out(sessions):
+    """(train, test) indices holding out each session in turn.
+
+    Args:
+        sessions: session of each trial, or a list of per-session arrays
+    """
+    if isinstance(sessions, (list, tuple)):
+        sessions = session_labels(sessions)
+    sessions = np.asarray(sessions)
+    if len(np.unique(sessions)) < 2:
+        raise Exception("At least two sessions are required to leave one out.")
+    return [(np.where(sessions != session)[0], np.where(sessions == session)[0])
+                for session in np.unique(sessions)]
+
+
+def session_labels(features):
+    """Session of each trial of a list of per-session arrays."""
+    return np.repeat(np.arange(len(features)), [len(session) for session in features])
+
+
+def pin_threads(threads):
+    """Limit the intra-op threads of the numerical libraries in this process."""
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    if 'tensorflow' in sys.modules:
+        tf = sys.modules['tensorflow']
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except RuntimeError:
+            pass # The runtime was already initialized
+
+
+def share(features, scratch_dir=None):
+    """Filenames of .npy files holding each session, and those written here to remove later.
+
+    Sessions memory-mapped from a .npy file that still exists are reused as they are.
+    """
+    sessions = features if isinstance(features, (list, tuple)) else [features]
+    filenames, written = [], []
+    for session in sessions:
+        filename = getattr(session, 'filename', None)
+        if isinstance(session, np.memmap) and filename and str(filename).endswith('.npy') \
+                and os.path.exists(filename) \
+                and np.load(filename, mmap_mode='r').shape == session.shape:
+            filenames.append(str(filename))
+            continue
+        fd, filename = tempfile.mkstemp(suffix='.npy', dir=scratch_dir)
+        os.close(fd)
+        np.save(filename, np.asarray(session))
+        filenames.append(filename)
+        written.append(filename)
+    return filenames, written
+
+
+def evaluate(job):
+    """Fit a decoder on the training trials of one fold and score it on the held-out trials."""
+    features = [np.load(filename, mmap_mode='r') for filename in job['filenames']]
+    train_inds, test_inds, targets = job['train'], job['test'], job['targets']
+
+    start = time.perf_counter()
+    if isinstance(job['decoder'], str):
+        decoder = decoders.select(job['decoder'], **job['params'])
+    else:
+        decoder = job['decoder'](**job['params'])
+    decoder.fit(epochs.gather(features, train_inds), targets[train_inds])
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predicted = np.asarray(decoder.predict(epochs.gather(features, test_inds)))
+    predict_time = time.perf_counter() - start
+
+    return {'fold': job['fold'], 'category': job['category'],
+            'accuracy': float(np.mean(predicted == targets[test_inds])),
+            'n_train': len(train_inds), 'n_test': len(test_inds),
+            'fit_time': fit_time, 'predict_time': predict_time}
+
+
+def run(features, labels, folds, decoder, params=None, processes=1, threads=1, scratch_dir=None):
+    """Cross-validate a decoder on every fold and category, with folds spread across processes.
+
+    The trials are shared with workers through memory-mapped .npy files, so
+    each worker reads only the trials of its fold. Every worker is started
+    with its numerical libraries limited to threads intra-op threads, so
+    processes x threads should not exceed the cores available.
+
+    Args:
+        features: Trials x ... array or memory map, or a list of them (one per session)
+        labels: dict of Trials-long label arrays per category
+        folds: list of (train, test) indices, as from :func:`kfold` or :func:`leave_one_session_out`
+        decoder: name of one of :mod:`engram.procedural.decoders`, or a class (or picklable
+                 factory) whose instances have fit(X, y) and predict(X)
+        params: keyword arguments of the decoder
+
+    Returns:
+        dict of {'folds': per-fold metrics, 'accuracy': mean, 'accuracy_std': std} per category
+    """
+    params = params or {}
+    filenames, written = share(features, scratch_dir=scratch_dir)
+    jobs = [{'fold': ii, 'category': category, 'filenames': filenames,
+                'train': np.asarray(train_inds, dtype='int'), 'test': np.asarray(test_inds, dtype='int'),
+                'targets': np.asarray(labels[category]), 'decoder': decoder, 'params': params}
+                for category in labels for ii, (train_inds, test_inds) in enumerate(folds)]
+
+    try:
+        if processes > 1 and len(jobs) > 1:
+            # Fresh interpreters read the thread limits as their libraries load
+            previous = {variable: os.environ.get(variable) for variable in THREAD_VARIABLES}
+            os.environ.update({variable: str(threads) for variable in THREAD_VARIABLES})
+            try:
+                with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=pin_threads, initargs=(threads,)) as executor:
+                    metrics = list(executor.map(evaluate, jobs))
+            finally:
+                for variable, value in previous.items():
+                    if value is None:
+                        os.environ.pop(variable, None)
+                    else:
+                        os.environ[variable] = value
+        else:
+            metrics = [evaluate(job) for job in jobs]
+    finally:
+        for filename in written:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    return summarize(metrics)
+
+
+def summarize(metrics):
+    """Group per-fold metrics by category, with the mean and spread of accuracy across folds."""
+    results = {}
+    for fold in metrics:
+        results.setdefault(fold['category'], {'folds': []})['folds'].append(fold)
+    for category, result in results.items():
+        accuracy = np.array([fold['accuracy'] for fold in result['folds']])
+        result['accuracy'] = float(np.mean(accuracy))
+        result['accuracy_std'] = float(np.std(accuracy))
+        print('{}: {:.2f} +/- {:.2f} accuracy over {} folds'.format(category, result['accuracy'],
+                                                                    result['accuracy_std'], len(accuracy)))
+    return results
@@ -0,0 +1,184 @@
+'''
+Linear and nearest-centroid decoders implemented with NumPy and SciPy.
+
+They fit in milliseconds on the same trial tensors and label dicts as
+:func:`engram.procedural.train.train`, without starting TensorFlow.
+'''
+
+from engram.procedural import epochs
+from scipy import linalg, optimize
+import numpy as np
+
+
+def select(decoder, **params):
+    selection = {
+        "LDA": LDA,
+        "ridge": Ridge,
+        "logistic": Logistic,
+        "centroid": NearestCentroid,
+    }
+    # Get the class from switcher dictionary
+    cls = selection.get(decoder, None)
+    if cls is None:
+        raise Exception("Unrecognized decoder.")
+    # Instantiate the decoder
+    return cls(**params)
+
+
+def fit(decoder='LDA', in_matrix=None, labels=None, **params):
+    """Fit one decoder per category of labels.
+
+    Args:
+        in_matrix: Trials x ... array or memory map, or a list of them (one per session)
+        labels: dict of Trials-long label arrays per category
+        params: keyword arguments of the decoder
+
+    Returns:
+        dict of fitted decoders per category
+    """
+    trials = epochs.gather(in_matrix, np.arange(len(next(iter(labels.values())))))
+    return {category: select(decoder, **params).fit(trials, labels[category]) for category in labels}
+
+
+def flatten(X):
+    """Trials x Features array of float64 from a Trials x ... tensor."""
+    X = np.asarray(X)
+    return X.reshape((len(X), -1)).astype('float64', copy=False)
+
+
+class Decoder(object):
+    """Classes, prediction and scoring shared by every decoder.
+
+    Subclasses implement fit(X, y) and decision(X), which gives a score per
+    class of every trial.
+    """
+
+    def encode(self, y):
+        self.classes, y = np.unique(np.asarray(y), return_inverse=True)
+        if len(self.classes) < 2:
+            raise Exception("At least two classes are required to fit a decoder.")
+        return y
+
+    def predict(self, X):
+        return self.classes[np.argmax(self.decision(X), axis=1)]
+
+    def score(self, X, y):
+        return float(np.mean(self.predict(X) == np.asarray(y)))
+
+
+class NearestCentroid(Decoder):
+    """Class whose mean trial is closest in Euclidean distance."""
+
+    def fit(self, X, y):
+        X, y = flatten(X), self.encode(y)
+        self.means = np.stack([X[y == label].mean(axis=0) for label in range(len(self.classes))])
+        return self
+
+    def decision(self, X):
+        # Negative squared distance, dropping the |x|^2 common to every class
+        return 2 * flatten(X) @ self.means.T - (self.means ** 2).sum(axis=1)
+
+
+class LDA(Decoder):
+    """Linear discriminant analysis with a shrunk, shared covariance.
+
+    The pooled within-class covariance S is shrunk towards a scaled identity,
+    (1 - shrinkage) S + shrinkage tr(S)/p I, and inverted through the SVD of
+    the centered trials, so features may far outnumber trials.
+    """
+
+    def __init__(self, shrinkage=.1):
+        self.shrinkage = shrinkage
+
+    def fit(self, X, y):
+        X, y = flatten(X), self.encode(y)
+        n_classes = len(self.classes)
+        means = np.stack([X[y == label].mean(axis=0) for label in range(n_classes)])
+        priors = np.bincount(y) / float(len(y))
+
+        _, s, Vt = linalg.svd(X - means[y], full_matrices=False)
+        variances = s ** 2 / max(len(y) - n_classes, 1)
+        scale = variances.sum() / X.shape[1] # tr(S)/p
+        if self.shrinkage <= 0 and len(variances) < X.shape[1]:
+            raise Exception("Shrinkage is required when features outnumber trials.")
+
+        # Inverse of the shrunk covariance applied to the means, in and out of the span of Vt
+        ridge = self.shrinkage * scale
+        projected = Vt @ means.T
+        inside = Vt.T @ (projected / ((1 - self.shrinkage) * variances + ridge)[:, None])
+        outside = (means.T - Vt.T @ projected) / ridge if ridge > 0 else 0
+        self.coef = inside + outside # Features x Classes
+        self.intercept = -.5 * np.einsum('ij,ji->i', means, self.coef) + np.log(priors)
+        return self
+
+    def decision(self, X):
+        return flatten(X) @ self.coef + self.intercept
+
+
+class Ridge(Decoder):
+    """Least-squares regression onto one-hot classes with an L2 penalty of alpha.
+
+    The system is solved in whichever of the feature or trial spaces is smaller.
+    """
+
+    def __init__(self, alpha=1.):
+        self.alpha = alpha
+
+    def fit(self, X, y):
+        X, y = flatten(X), self.encode(y)
+        targets = np.eye(len(self.classes))[y]
+        self.mean, target_mean = X.mean(axis=0), targets.mean(axis=0)
+        X, targets = X - self.mean, targets - target_mean
+
+        if X.shape[1] <= X.shape[0]:
+            gram = X.T @ X
+            gram.flat[::len(gram) + 1] += self.alpha
+            self.coef = linalg.solve(gram, X.T @ targets, assume_a='pos')
+        else:
+            gram = X @ X.T
+            gram.flat[::len(gram) + 1] += self.alpha
+            self.coef = X.T @ linalg.solve(gram, targets, assume_a='pos')
+        self.intercept = target_mean - self.mean @ self.coef
+        return self
+
+    def decision(self, X):
+        return flatten(X) @ self.coef + self.intercept
+
+
+class Logistic(Decoder):
+    """Multinomial logistic regression with an L2 penalty of alpha, fit by L-BFGS.
+
+    Features are standardized with the statistics of the training trials.
+    """
+
+    def __init__(self, alpha=1., max_iter=200):
+        self.alpha = alpha
+        self.max_iter = max_iter
+
+    def fit(self, X, y):
+        X, y = flatten(X), self.encode(y)
+        self.mean, self.std = X.mean(axis=0), X.std(axis=0)
+        self.std[self.std == 0] = 1
+        X = (X - self.mean) / self.std
+        n_trials, n_features = X.shape
+        n_classes = len(self.classes)
+        targets = np.eye(n_classes)[y]
+
+        def loss(params):
+            W = params[:-n_classes].reshape((n_features, n_classes))
+            logits = X @ W + params[-n_classes:]
+            logits -= logits.max(axis=1, keepdims=True)
+            log_probs = logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))
+            error = (np.exp(log_probs) - targets) / n_trials
+            value = -(targets * log_probs).sum() / n_trials + .5 * self.alpha * (W ** 2).sum() / n_trials
+            gradient = np.concatenate(((X.T @ error + self.alpha * W / n_trials).ravel(), error.sum(axis=0)))
+            return value, gradient
+
+        result = optimize.minimize(loss, np.zeros((n_features + 1) * n_classes), jac=True,
+                                    method='L-BFGS-B', options={'maxiter': self.max_iter})
+        self.coef = result.x[:-n_classes].reshape((n_features, n_classes))
+        self.intercept = result.x[-n_classes:]
+        return self
+
+    def decision(self, X):
+        return ((flatten(X) - self.mean) / self.std) @ self.coef + self.intercept
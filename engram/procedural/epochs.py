@@ -0,0 +1,129 @@
+'''
+Functions to cut fixed-length windows (epochs) out of continuous data.
+'''
+
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import sparse
+import numpy as np
+
+
+def nearest(labels, targets):
+    """Index of the label closest to each target, for sorted labels."""
+    labels = np.asarray(labels)
+    targets = np.asarray(targets, dtype=float)
+    if len(labels) < 2:
+        return np.zeros(targets.shape, dtype='int')
+    right = np.clip(np.searchsorted(labels, targets), 1, len(labels) - 1)
+    left = right - 1
+    return np.where(targets - labels[left] <= labels[right] - targets, left, right)
+
+
+def locate(labels, times, bounds):
+    """First index and common length of the window around each time.
+
+    Both bounds of every window are found with a single search. The length
+    is the most common distance between them, and windows running past the
+    ends of labels are shifted back inside.
+
+    Args:
+        labels: sorted time of each sample
+        times: event times
+        bounds: (start, stop) of each window relative to its event
+
+    Returns:
+        starts: first index of each window
+        length: number of samples in every window
+    """
+    times = np.asarray(times, dtype=float)
+    if len(times) == 0:
+        return np.zeros(0, dtype='int'), 0
+    edges = nearest(labels, np.add.outer(times, np.asarray(bounds, dtype=float))) # Trials x 2
+    lengths, counts = np.unique(edges[:, 1] - edges[:, 0], return_counts=True)
+    length = int(min(lengths[np.argmax(counts)], len(labels)))
+    starts = np.clip(edges[:, 0], 0, len(labels) - length)
+    return starts, length
+
+
+def views(data, starts, length, axis=1):
+    """Window of data along an axis beginning at each start.
+
+    Windows of arrays and memory maps are views, so no samples are copied.
+    Sparse and lazy data are sliced, which reads only the windows.
+    """
+    if sparse.issparse(data):
+        data = sparse.csc_matrix(data) if axis == 1 else data
+        return [data[:, start:start+length] for start in starts]
+    leading = (slice(None),) * axis
+    return [data[leading + (slice(start, start+length),)] for start in starts]
+
+
+def stack(data, starts, length, axis=1, out=None):
+    """Windows of data gathered into one (Windows x ...) array, or into out."""
+    windows = views(data, starts, length, axis=axis)
+    if out is None:
+        shape = (len(starts),) + tuple(data.shape[:axis]) + (length,) + tuple(data.shape[axis+1:])
+        out = np.empty(shape, dtype=data.dtype)
+    for ii, window in enumerate(windows):
+        out[ii] = window.toarray() if sparse.issparse(window) else window
+    return out
+
+
+def sliding(data, length, step=1, axis=1):
+    """Every window of length samples, step samples apart, as one (Windows x ...) strided view.
+
+    No samples are copied: consecutive windows overlap in memory.
+    """
+    windows = sliding_window_view(data, length, axis=axis)[(slice(None),) * axis + (slice(None, None, step),)]
+    # (..., Windows, ..., Length) -> (Windows, ..., Length, ...)
+    return np.moveaxis(np.moveaxis(windows, -1, axis + 1), axis, 0)
+
+
+def batches(data, length, step=1, batch_size=1024, axis=1):
+    """Yield (starts, windows) for successive batches of sliding windows.
+
+    Windows of arrays and memory maps are strided views of data. Sparse and
+    lazy data are read one batch span at a time, so only the samples under
+    the current batch are ever loaded.
+    """
+    n_samples = data.shape[axis]
+    n_windows = max((n_samples - length) // step + 1, 0)
+    in_memory = isinstance(data, np.ndarray)
+    if in_memory and n_windows:
+        windows = sliding(data, length, step, axis=axis)
+
+    for first in range(0, n_windows, batch_size):
+        last = min(first + batch_size, n_windows)
+        starts = np.arange(first, last) * step
+        if in_memory:
+            yield starts, windows[first:last]
+            continue
+        span = (slice(None),) * axis + (slice(starts[0], starts[-1] + length),)
+        block = data[span]
+        block = block.toarray() if sparse.issparse(block) else np.asarray(block)
+        yield starts, sliding(block, length, step, axis=axis)
+
+
+def trial_shape(features):
+    """Shape of one trial of an array, or of a list of per-session arrays."""
+    if isinstance(features, (list, tuple)):
+        return tuple(np.shape(features[0])[1:])
+    return tuple(np.shape(features)[1:])
+
+
+def gather(features, indices):
+    """Trials at the given indices of an array or of a list of per-session arrays.
+
+    Indices run through the sessions in order, and only the requested trials
+    of memory-mapped sessions are read.
+    """
+    indices = np.asarray(indices, dtype='int')
+    if not isinstance(features, (list, tuple)):
+        return np.asarray(features[indices])
+
+    offsets = np.cumsum([0] + [len(session) for session in features])
+    sessions = np.searchsorted(offsets, indices, side='right') - 1
+    out = np.empty((len(indices),) + trial_shape(features), dtype=np.result_type(*features))
+    for session in np.unique(sessions):
+        rows = np.where(sessions == session)[0]
+        out[rows] = features[session][indices[rows] - offsets[session]]
+    return out
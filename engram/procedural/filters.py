@@ -1,14 +1,16 @@
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from scipy.signal import butter, sosfilt, sosfilt_zi, sosfiltfilt, tf2zpk
+import numpy as np
 
-from scipy.signal import butter, filtfilt
-
-def select(filter,data,min=0,max=None,fs=2000,order=5):
+def select(filter,data,min=0,max=None,fs=2000,order=5,axis=-1,workers=1,dtype=None):
     selection = {
         "bandpass": butter_bandpass_filter
     }
     # Get the function from switcher dictionary
     func = selection.get(filter, lambda: "Invalid event parser")
     # Execute the function
-    return func(data,min,max,fs,order)
+    return func(data,min,max,fs,order,axis=axis,workers=workers,dtype=dtype)
 
 def butter_lowpass(cutoff, fs, order=5):
     nyq = 0.5 * fs
@@ -16,10 +18,9 @@ def butter_lowpass(cutoff, fs, order=5):
     b, a = butter(order, normal_cutoff, btype='low', analog=False)
     return b, a
 
-def butter_lowpass_filter(data, cutoff, fs, order=5):
-    b, a = butter_lowpass(cutoff, fs, order=order)
-    y = filtfilt(b, a, data)
-    return y
+def butter_lowpass_filter(data, cutoff, fs, order=5, axis=-1, workers=1, dtype=None):
+    sos = butter_sos(None, cutoff, fs, order=order)
+    return sos_filter(data, sos, axis=axis, workers=workers, dtype=dtype)
 
 def butter_bandpass(lowcut, highcut, fs, order=5):
     nyq = 0.5 * fs
@@ -29,7 +30,185 @@ def butter_bandpass(lowcut, highcut, fs, order=5):
     return b, a
 
 
-def butter_bandpass_filter(data, lowcut, highcut, fs, order=5):
-    b, a = butter_bandpass(lowcut, highcut, fs, order=order)
-    y = filtfilt(b, a, data)
-    return y
\ No newline at end of file
+def butter_bandpass_filter(data, lowcut, highcut, fs, order=5, axis=-1, workers=1, dtype=None):
+    sos = butter_sos(lowcut, highcut, fs, order=order)
+    return sos_filter(data, sos, axis=axis, workers=workers, dtype=dtype)
+
+def butter_sos(lowcut, highcut, fs, order=5):
+    """Design a Butterworth filter as second-order sections.
+
+    Designs are cached per (lowcut, highcut, fs, order), and each call gets
+    its own copy of the sections, so changing one cannot affect later
+    filters. A missing or zero lowcut gives a lowpass filter, and a missing
+    highcut (or one at or above Nyquist) gives a highpass filter.
+    """
+    return _butter_sos(lowcut, highcut, fs, order).copy()
+
+@lru_cache(maxsize=None)
+def _butter_sos(lowcut, highcut, fs, order):
+    nyq = 0.5 * fs
+    if highcut is not None and highcut >= nyq:
+        highcut = None
+    if not lowcut:
+        sos = butter(order, highcut / nyq, btype='low', output='sos')
+    elif highcut is None:
+        sos = butter(order, lowcut / nyq, btype='high', output='sos')
+    else:
+        sos = butter(order, [lowcut / nyq, highcut / nyq], btype='band', output='sos')
+    sos.setflags(write=False) # The cached design itself is never handed out
+    return sos
+
+def sos_filter(data, sos, axis=-1, workers=1, dtype=None):
+    """Zero-phase filter an array of any shape along one axis.
+
+    With workers > 1, the other axes are split into blocks that are filtered
+    on separate threads. The output has the given dtype, or at least float64.
+    """
+    if not hasattr(data, 'shape'):
+        data = np.asarray(data) # Lazy arrays are only read block by block
+    if dtype is None:
+        dtype = np.result_type(data.dtype, np.float64)
+    if workers <= 1 or data.ndim < 2:
+        return sosfiltfilt(sos, np.asarray(data), axis=axis).astype(dtype, copy=False)
+
+    # Split along the largest of the other axes
+    axis = axis % data.ndim
+    split_axis = max((dim for dim in range(data.ndim) if dim != axis), key=lambda dim: data.shape[dim])
+    output = np.empty(data.shape, dtype=dtype)
+    bounds = np.linspace(0, data.shape[split_axis], workers + 1).astype('int')
+
+    def run(block):
+        index = [slice(None)] * data.ndim
+        index[split_axis] = slice(bounds[block], bounds[block+1])
+        index = tuple(index)
+        output[index] = sosfiltfilt(sos, data[index], axis=axis)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run, range(workers)))
+
+    return output
+
+
+def chunked_filter(data, sos, chunk_size=2**20, out=None, dtype=None):
+    """Zero-phase filter a Channels x Time array read chunk by chunk.
+
+    Chunks of ``chunk_size`` samples are read from ``data`` (an ndarray,
+    memmap or lazy array) and streamed through a :class:`StreamingFilter`,
+    so the output matches :func:`sos_filter` over the whole array to within
+    its tolerance. The output is written into ``out`` if given.
+    """
+    n_samples = data.shape[-1]
+    if out is None:
+        out = np.empty(data.shape, dtype=dtype or np.result_type(data.dtype, np.float64))
+    stream = StreamingFilter(sos, mode='zerophase')
+    written = 0
+    for start in range(0, n_samples, chunk_size):
+        filtered = stream.process(np.asarray(data[:, start:start+chunk_size], dtype=float))
+        if start + chunk_size >= n_samples:
+            filtered = np.concatenate((filtered, stream.flush()), axis=-1)
+        out[:, written:written+filtered.shape[-1]] = filtered
+        written += filtered.shape[-1]
+    return out
+
+
+class StreamingFilter(object):
+    """Filter successive chunks of an array along its last axis.
+
+    In 'causal' mode, each chunk is filtered as it arrives with sosfilt,
+    carrying the filter state across chunks. The output equals a single
+    sosfilt pass over the whole array started from the steady state of the
+    first sample.
+
+    In 'zerophase' mode, the forward pass is carried across chunks in the
+    same way and the backward pass is run over the buffered forward output,
+    holding back the last `margin` samples until more data (or flush)
+    arrives. The output matches sosfiltfilt over the whole array to within
+    `tol`, which sets the default margin from the slowest filter pole.
+
+    Example:
+        >>> stream = StreamingFilter(butter_sos(1, 250, 2000), mode='zerophase')
+        >>> y = np.concatenate([stream.process(chunk) for chunk in chunks] + [stream.flush()], axis=-1)
+    """
+
+    def __init__(self, sos, mode='causal', margin=None, tol=1e-6):
+        if mode not in ('causal', 'zerophase'):
+            raise Exception("Unrecognized filter mode.")
+        self.sos = np.asarray(sos)
+        self.mode = mode
+        if margin is None:
+            margin = settling_samples(self.sos, tol)
+        self.margin = int(margin)
+        self.padlen = 3 * (2 * len(self.sos) + 1 - min((self.sos[:, 2] == 0).sum(),
+                                                        (self.sos[:, 5] == 0).sum()))
+        self._zi = None
+        self._pending = None # Raw samples waiting for the odd extension at the start
+        self._forward = None # Forward-filtered samples not yet emitted
+        self._tail = None # Last raw samples, for the odd extension at the end
+
+    def _initial_state(self, x0):
+        zi = sosfilt_zi(self.sos)
+        return zi.reshape((zi.shape[0],) + (1,) * np.ndim(x0) + (2,)) * np.asarray(x0)[None, ..., None]
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk)
+        if self.mode == 'causal':
+            if self._zi is None:
+                self._zi = self._initial_state(chunk[..., 0])
+            output, self._zi = sosfilt(self.sos, chunk, axis=-1, zi=self._zi)
+            return output
+
+        # Zero-phase: wait for enough samples to extend the start like sosfiltfilt
+        if self._zi is None:
+            if self._pending is not None:
+                chunk = np.concatenate((self._pending, chunk), axis=-1)
+            if chunk.shape[-1] <= self.padlen:
+                self._pending = chunk
+                return chunk[..., :0]
+            self._pending = None
+            extension = 2 * chunk[..., :1] - chunk[..., self.padlen:0:-1]
+            self._zi = self._initial_state(extension[..., 0])
+            _, self._zi = sosfilt(self.sos, extension, axis=-1, zi=self._zi)
+            self._forward = chunk[..., :0].astype(np.result_type(chunk.dtype, np.float64))
+
+        forward, self._zi = sosfilt(self.sos, chunk, axis=-1, zi=self._zi)
+        self._forward = np.concatenate((self._forward, forward), axis=-1)
+        self._tail = np.concatenate((self._tail, chunk), axis=-1)[..., -(self.padlen+1):] \
+                        if self._tail is not None else chunk[..., -(self.padlen+1):]
+
+        n_ready = self._forward.shape[-1] - self.margin
+        if n_ready <= 0:
+            return self._forward[..., :0]
+        output = self._backward(self._forward)[..., :n_ready]
+        self._forward = self._forward[..., n_ready:]
+        return output
+
+    def flush(self):
+        if self.mode == 'causal':
+            self._zi = None
+            return np.empty(0)
+
+        if self._zi is None:
+            # Fewer samples than the padding arrived, so filter them directly
+            output = sosfiltfilt(self.sos, self._pending, axis=-1) if self._pending is not None \
+                        else np.empty(0)
+        else:
+            # Extend the end like sosfiltfilt and run the final backward pass
+            extension = 2 * self._tail[..., -1:] - self._tail[..., -2:-(self.padlen+2):-1]
+            forward, _ = sosfilt(self.sos, extension, axis=-1, zi=self._zi)
+            forward = np.concatenate((self._forward, forward), axis=-1)
+            output = self._backward(forward)[..., :forward.shape[-1]-self.padlen]
+
+        self._zi = self._pending = self._forward = self._tail = None
+        return output
+
+    def _backward(self, forward):
+        reverse = forward[..., ::-1]
+        output, _ = sosfilt(self.sos, reverse, axis=-1, zi=self._initial_state(reverse[..., 0]))
+        return output[..., ::-1]
+
+def settling_samples(sos, tol=1e-6):
+    """Number of samples for the impulse response of a filter to decay below tol."""
+    radius = max(np.max(np.abs(tf2zpk(section[:3], section[3:])[1]), initial=0) for section in sos)
+    if radius <= 0:
+        return 1
+    return int(np.ceil(np.log(tol) / np.log(radius)))
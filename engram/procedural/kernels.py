@@ -0,0 +1,129 @@
+'''
+Functions to convolve spike trains with smoothing kernels.
+'''
+
+from scipy import signal, sparse
+import numpy as np
+
+BLOCK_SIZE = 2**22 # Spike-kernel products scattered at once
+
+
+def select(kernel, width):
+    selection = {
+        "triangular": triangular,
+        "gaussian": gaussian,
+        "exponential": exponential,
+    }
+    # Get the function from switcher dictionary
+    func = selection.get(kernel, None)
+    if func is None:
+        raise Exception("Unrecognized kernel.")
+    # Execute the function
+    return func(width)
+
+
+def triangular(width):
+    """Symmetric ramp up to and down from each spike, lasting width samples on each side.
+
+    Returns:
+        weights: kernel values
+        origin: index of the spike in weights
+    """
+    width = max(int(width), 1)
+    return 1 - np.abs(np.arange(-width + 1, width)) / width, width - 1
+
+
+def gaussian(width):
+    """Gaussian with a standard deviation of width samples, truncated at 4 deviations."""
+    half = int(np.ceil(4 * width))
+    offsets = np.arange(-half, half + 1)
+    return np.exp(-0.5 * (offsets / float(width)) ** 2), half
+
+
+def exponential(width):
+    """Causal exponential decay with a time constant of width samples."""
+    offsets = np.arange(int(np.ceil(5 * width)) + 1)
+    return np.exp(-offsets / float(width)), 0
+
+
+def convolve(spikes, kernel='triangular', width=50, start=0, stop=None, method='auto', dtype='float64'):
+    """Smooth every spike train with a kernel, over a window of samples.
+
+    Only spikes whose kernel reaches the window are used, so any window of
+    a long recording is computed on demand without building the full trains.
+
+    Args:
+        spikes: Units x Time sparse matrix (or array) of spike counts
+        kernel: name of the kernel, or (weights, origin)
+        width: width of the kernel in samples
+        start, stop: window of samples to compute (to the end of spikes if stop is None)
+        method: 'scatter' adds the kernel at every spike, 'fft' convolves
+                dense trains; 'auto' picks the cheaper one
+
+    Returns:
+        Units x (stop - start) array
+    """
+    spikes = sparse.csr_matrix(spikes)
+    weights, origin = select(kernel, width) if isinstance(kernel, str) else kernel
+    weights = np.asarray(weights, dtype=dtype)
+    n_units, n_samples = spikes.shape
+    if stop is None:
+        stop = n_samples
+    n_window = stop - start
+
+    # Spikes whose kernel overlaps the window
+    units = np.repeat(np.arange(n_units), np.diff(spikes.indptr))
+    times = spikes.indices
+    lower, upper = start - (len(weights) - 1 - origin), stop + origin
+    keep = (times >= lower) & (times < upper)
+    units, times, counts = units[keep], times[keep], spikes.data[keep]
+
+    if method == 'auto':
+        method = 'scatter' if len(times) * len(weights) <= 4 * n_units * (upper - lower) else 'fft'
+
+    if method == 'fft':
+        trains = np.zeros((n_units, upper - lower), dtype=dtype)
+        np.add.at(trains, (units, times - lower), counts)
+        full = signal.oaconvolve(trains, weights[None, :], mode='full', axes=1)
+        return np.ascontiguousarray(full[:, len(weights)-1:len(weights)-1+n_window], dtype=dtype)
+
+    output = np.zeros(n_units * n_window, dtype=dtype)
+    offsets = np.arange(len(weights)) - origin
+    step = max(1, BLOCK_SIZE // len(weights))
+    for block in range(0, len(times), step):
+        positions = times[block:block+step, None] + offsets[None, :] - start
+        valid = (positions >= 0) & (positions < n_window)
+        flat = (units[block:block+step, None] * n_window + positions)[valid]
+        values = (counts[block:block+step, None] * weights[None, :])[valid]
+        output += np.bincount(flat, weights=values, minlength=len(output)).astype(dtype, copy=False)
+    return output.reshape((n_units, n_window))
+
+
+class Activity(object):
+    """Smoothed spike trains computed block by block as they are indexed.
+
+    Example:
+        >>> activity = Activity(binary.data, 'triangular', 50)
+        >>> frame = activity[t] # Value of every unit at sample t
+    """
+
+    def __init__(self, spikes, kernel='triangular', width=50, block=2**14, dtype='float64'):
+        self.spikes = sparse.csr_matrix(spikes)
+        self.kernel = select(kernel, width) if isinstance(kernel, str) else kernel
+        self.block = int(block)
+        self.dtype = dtype
+        self._start = None
+        self._window = None
+
+    def __len__(self):
+        return self.spikes.shape[1]
+
+    def window(self, start, stop):
+        return convolve(self.spikes, self.kernel, start=start, stop=stop, dtype=self.dtype)
+
+    def __getitem__(self, t):
+        start = (int(t) // self.block) * self.block
+        if start != self._start:
+            self._window = self.window(start, min(start + self.block, len(self)))
+            self._start = start
+        return self._window[:, int(t) - start]
@@ -0,0 +1,126 @@
+'''
+Functions to normalize continuous features in place, chunk by chunk.
+'''
+
+import numpy as np
+
+BLOCK_SIZE = 2**25 # Bytes of data normalized at once
+
+
+class RunningStats(object):
+    """Mean and standard deviation along one axis, accumulated in a single pass.
+
+    Chunks are merged with Welford's (Chan et al.'s) update, so statistics
+    of arrays that never fit in memory, or of data that is still arriving,
+    can be computed without a second pass.
+
+    Example:
+        >>> stats = RunningStats(axis=-1)
+        >>> for chunk in chunks:
+        ...     stats.update(chunk)
+        ...     normalized = stats.apply(chunk)
+    """
+
+    def __init__(self, axis=-1):
+        self.axis = axis
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk)
+        n = chunk.shape[self.axis]
+        if n == 0:
+            return self
+        mean = chunk.mean(axis=self.axis, dtype=np.float64, keepdims=True)
+        m2 = np.square(chunk - mean, dtype=np.float64).sum(axis=self.axis, keepdims=True)
+
+        if self.count == 0:
+            self.mean, self.m2 = mean, m2
+        else:
+            total = self.count + n
+            delta = mean - self.mean
+            self.mean = self.mean + delta * (n / total)
+            self.m2 = self.m2 + m2 + np.square(delta) * (self.count * n / total)
+        self.count += n
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count)
+
+    def apply(self, chunk, out=None):
+        """Z-score a chunk with the statistics accumulated so far."""
+        chunk = np.asarray(chunk)
+        if out is None:
+            out = np.array(chunk, dtype=np.result_type(chunk.dtype, np.float32))
+        elif out is not chunk:
+            out[...] = chunk
+        out -= self.mean.astype(out.dtype)
+        out /= self.std.astype(out.dtype)
+        return out
+
+
+def blocks(shape, axis, itemsize):
+    """Slices that split an array into blocks along an axis."""
+    axis = axis % len(shape)
+    per_index = itemsize * int(np.prod(shape)) // max(shape[axis], 1)
+    step = max(1, BLOCK_SIZE // max(per_index, 1))
+    for start in range(0, shape[axis], step):
+        index = [slice(None)] * len(shape)
+        index[axis] = slice(start, start + step)
+        yield tuple(index)
+
+
+def writable(data, dtype='float32'):
+    """The array itself if it can be normalized in place, otherwise a copy."""
+    if isinstance(data, np.ndarray) and data.flags.writeable and data.dtype.kind == 'f':
+        return data
+    return np.array(data, dtype=dtype)
+
+
+def log_transform(data):
+    """Convert power to decibels in place."""
+    data = writable(data)
+    for index in blocks(data.shape, 0, data.itemsize):
+        np.log10(data[index], out=data[index])
+        data[index] *= 10
+    return data
+
+
+def zscore(data, axis=-1, log_transform=False):
+    """Z-score an array along an axis in place, reading it one block at a time.
+
+    The statistics are accumulated with :class:`RunningStats` in one pass
+    and applied in a second, so memory-mapped arrays are never fully loaded.
+    """
+    data = writable(data)
+    stats = RunningStats(axis=axis)
+    for index in blocks(data.shape, axis, data.itemsize):
+        if log_transform:
+            np.log10(data[index], out=data[index])
+            data[index] *= 10
+        stats.update(data[index])
+    for index in blocks(data.shape, axis, data.itemsize):
+        stats.apply(data[index], out=data[index])
+    return data
+
+
+def baseline(data, times, bounds, axis=-1):
+    """Z-score each trial against its own pre-event baseline.
+
+    Args:
+        data: (Trials x ... x Time x ...) array
+        times: time of each sample along axis, relative to the event
+        bounds: (start, stop) of the baseline window in the same units as times
+        axis: the time axis
+    """
+    data = writable(data)
+    window = [slice(None)] * data.ndim
+    window[axis] = np.where((np.asarray(times) >= bounds[0]) & (np.asarray(times) < bounds[1]))[0]
+    reference = data[tuple(window)]
+    mean = reference.mean(axis=axis, keepdims=True)
+    std = reference.std(axis=axis, keepdims=True)
+    data -= mean
+    data /= std
+    return data
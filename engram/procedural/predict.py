@@ -1,14 +1,98 @@
+'''
+Functions and a real-time :class:`Predictor` to decode trials with a trained model.
+
+Keras models are called directly with training=False rather than through
+model.predict, which adds milliseconds of overhead per call. Decoders from
+:mod:`engram.procedural.decoders` are scored with their decision function.
+'''
+
+from collections import deque
+import time
+
+from engram.procedural import epochs
 import numpy as np
 
+
+def scores(model, trials):
+    """Output of the model for a batch of trials (Trials x Outputs)."""
+    if hasattr(model, 'decision'):
+        return model.decision(trials)
+    return np.asarray(model(trials, training=False))
+
+
 def predict(model = None,mneme=None):
     channels = len(mneme)
     times = len(mneme[0][0])
     reshape = (-1, channels, times)
 
     network_input = np.array(mneme).reshape(reshape)
-    out = model.predict(network_input)
+    out = scores(model, network_input)
 
     choice = np.argmax(out)
     prediction = mneme.options[choice]
 
     return prediction
+
+
+def predict_batch(model=None, trials=None, batch_size=256, options=None, dtype='float32'):
+    """Decode many trials at once, batch_size trials per call of the model.
+
+    Args:
+        trials: Trials x ... array or memory map, or a list of them (one per session)
+        options: label of each output (the index of the best output is returned if None)
+
+    Returns:
+        choices: prediction for each trial
+        outputs: Trials x Outputs scores
+    """
+    n_trials = sum(len(session) for session in trials) if isinstance(trials, (list, tuple)) else len(trials)
+    outputs = None
+    for first in range(0, n_trials, batch_size):
+        batch = epochs.gather(trials, np.arange(first, min(first + batch_size, n_trials)))
+        out = scores(model, batch.astype(dtype, copy=False))
+        if outputs is None:
+            outputs = np.empty((n_trials,) + out.shape[1:], dtype=out.dtype)
+        outputs[first:first + len(out)] = out
+
+    if outputs is None:
+        return np.zeros(0, dtype='int'), np.zeros((0,))
+    choices = np.argmax(outputs.reshape((n_trials, -1)), axis=1)
+    if options is not None:
+        choices = np.asarray(options)[choices]
+    return choices, outputs
+
+
+class Predictor(object):
+    """Decode one trial at a time with as little overhead per call as possible.
+
+    The input buffer is allocated once, the model is warmed up on it (so
+    graph tracing and memory allocation happen before the first real trial),
+    and the latency of every call is recorded.
+
+    Example:
+        >>> predictor = Predictor(model, shape=(channels, times, freqs), options=['Left', 'Right'])
+        >>> choice = predictor(trial)
+        >>> predictor.latency() # {50: ms, 90: ms, 99: ms}
+    """
+
+    def __init__(self, model, shape, options=None, dtype='float32', warmup=10, history=10000):
+        self.model = model
+        self.options = options
+        self.buffer = np.zeros((1,) + tuple(shape), dtype=dtype)
+        self.latencies = deque(maxlen=history) # Seconds per call
+        for _ in range(warmup):
+            scores(self.model, self.buffer)
+
+    def __call__(self, trial):
+        start = time.perf_counter()
+        np.copyto(self.buffer[0], trial, casting='unsafe')
+        choice = int(np.argmax(scores(self.model, self.buffer)))
+        self.latencies.append(time.perf_counter() - start)
+        return choice if self.options is None else self.options[choice]
+
+    def latency(self, percentiles=(50, 90, 99)):
+        """Percentiles of the recorded latencies, in milliseconds."""
+        if not self.latencies:
+            return {}
+        values = np.percentile(np.asarray(self.latencies) * 1000, percentiles)
+        return {percentile: float(value) for percentile, value in zip(percentiles, values)}
@@ -0,0 +1,86 @@
+'''
+Functions to resample multichannel signals with polyphase filters.
+'''
+
+from fractions import Fraction
+from functools import lru_cache
+from scipy import signal
+import numpy as np
+
+CHUNK_SIZE = 2**20 # Input samples per channel resampled at once
+
+
+def ratio(fs, new_fs, max_denominator=1000):
+    """Smallest up/down factors that take fs to (approximately) new_fs."""
+    fraction = Fraction(float(new_fs) / float(fs)).limit_denominator(max_denominator)
+    return fraction.numerator, fraction.denominator
+
+
+def size(n_samples, fs, new_fs):
+    """Number of samples after resampling n_samples from fs to new_fs."""
+    up, down = ratio(fs, new_fs)
+    return -(-n_samples * up // down)
+
+
+@lru_cache(maxsize=None)
+def anti_alias(up, down):
+    """Kaiser-windowed lowpass used by scipy.signal.resample_poly for these factors."""
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+
+
+def resample(data, fs, new_fs, chunk_size=None, filename=None, dtype='float64', out=None):
+    """Resample an array along its last axis by a rational factor.
+
+    The signal is upsampled, lowpass filtered against aliasing and
+    downsampled in one polyphase pass. With ``chunk_size``, the input is read
+    (from an ndarray, memmap or lazy array) and resampled in chunks that
+    overlap by the length of the filter, so the output is identical to
+    resampling the whole array at once.
+
+    Args:
+        fs: sampling frequency of data
+        new_fs: desired sampling frequency, approximated by a ratio of small integers
+        filename: path of a .npy file to memory-map the output into
+        out: array to write the output into instead (see :func:`size`)
+
+    Returns:
+        data: (..., Time) array
+        fs: the exact new sampling frequency
+    """
+    up, down = ratio(fs, new_fs)
+    taps = anti_alias(up, down)
+    n_samples = data.shape[-1]
+    n_output = size(n_samples, fs, new_fs)
+    shape = tuple(data.shape[:-1]) + (n_output,)
+
+    if out is not None:
+        if out.shape != shape:
+            raise Exception("The output array does not have the shape of the resampled data.")
+    elif filename:
+        out = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+    else:
+        out = np.empty(shape, dtype=dtype)
+
+    # Chunks start on multiples of down so they map to whole output samples
+    chunk_size = chunk_size or n_samples
+    step = down * max(1, chunk_size // down)
+    margin = down * -(-(len(taps) // (2 * up) + 2) // down)
+    leading = (slice(None),) * (len(data.shape) - 1)
+
+    for start in range(0, n_samples, step):
+        lower = max(start - margin, 0)
+        upper = min(start + step + margin, n_samples)
+        segment = np.asarray(data[leading + (slice(lower, upper),)], dtype=float)
+        resampled = signal.resample_poly(segment, up, down, axis=-1, window=taps)
+
+        first = start * up // down
+        last = min((start + step) * up // down, n_output)
+        offset = lower * up // down
+        out[..., first:last] = resampled[..., first-offset:last-offset]
+
+    if isinstance(out, np.memmap):
+        out.flush()
+
+    return out, fs * up / float(down)
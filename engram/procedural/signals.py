@@ -0,0 +1,91 @@
+'''
+Functions to ingest continuous signals from Neo RawIO readers.
+
+Signals are read in fixed-size chunks and only for the requested channels,
+so peak memory is bounded by the chunk size rather than the recording length.
+'''
+
+import numpy as np
+
+CHUNK_SIZE = 2**20 # Samples per channel read at once
+
+
+def read(reader, channels=None, filename=None, chunk_size=CHUNK_SIZE, dtype='float64'):
+    """Read continuous signals from a Neo RawIO reader in chunks.
+
+    Args:
+        reader: Neo reader whose header has already been parsed
+        channels: zero-based channel indexes to keep (all channels if None)
+        filename: path of a .npy file to memory-map the output into.
+                  The output is held in memory when not provided.
+        chunk_size: number of samples read per channel at once
+        dtype: floating point type of the rescaled signals
+
+    Returns:
+        data: Channels x Time array (memory-mapped if filename is given)
+        fs: sampling frequency of the signals
+    """
+
+    data = allocate(reader, channels, filename, dtype)
+    for i_start, i_stop, raw_sigs in chunks(reader, channels, chunk_size):
+        float_sigs = reader.rescale_signal_raw_to_float(raw_sigs, dtype=dtype,
+                                                        channel_indexes=channels)
+        data[:, i_start:i_stop] = float_sigs.T
+        del raw_sigs, float_sigs
+
+    if filename:
+        data.flush()
+
+    return data, reader.get_signal_sampling_rate()
+
+
+def read_raw(reader, channels=None, filename=None, chunk_size=CHUNK_SIZE):
+    """Read continuous signals from a Neo RawIO reader in their native type.
+
+    Samples are copied chunk by chunk without rescaling, so they keep the
+    (typically 2-byte) type of the recording. Rescaled signals are
+    ``data * gain + offset`` per channel.
+
+    Returns:
+        data: Channels x Time raw array (memory-mapped if filename is given)
+        gain, offset: per-channel scaling of the raw samples
+        fs: sampling frequency of the signals
+    """
+
+    signal_channels = reader.header['signal_channels']
+    if channels is not None:
+        signal_channels = signal_channels[np.asarray(channels)]
+
+    data = allocate(reader, channels, filename, signal_channels['dtype'][0])
+    for i_start, i_stop, raw_sigs in chunks(reader, channels, chunk_size):
+        data[:, i_start:i_stop] = raw_sigs.T
+        del raw_sigs
+
+    if filename:
+        data.flush()
+
+    return data, signal_channels['gain'], signal_channels['offset'], reader.get_signal_sampling_rate()
+
+
+def allocate(reader, channels, filename, dtype):
+    if channels is not None:
+        n_channels = len(channels)
+    else:
+        n_channels = len(reader.header['signal_channels'])
+    n_samples = reader.get_signal_size(block_index=0, seg_index=0)
+
+    if filename:
+        return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                        shape=(n_channels, n_samples))
+    return np.empty((n_channels, n_samples), dtype=dtype)
+
+
+def chunks(reader, channels, chunk_size=CHUNK_SIZE):
+    """Successive (i_start, i_stop, Time x Channels raw samples) of a recording."""
+    n_samples = reader.get_signal_size(block_index=0, seg_index=0)
+    for i_start in range(0, n_samples, chunk_size):
+        i_stop = min(i_start + chunk_size, n_samples)
+        raw_sigs = reader.get_analogsignal_chunk(block_index=0, seg_index=0,
+                                                i_start=i_start, i_stop=i_stop,
+                                                channel_indexes=channels)
+        yield i_start, i_stop, raw_sigs
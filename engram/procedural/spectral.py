@@ -0,0 +1,175 @@
+'''
+Functions to compute spectrograms of multichannel signals.
+'''
+
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+import numpy as np
+from engram.procedural import filters
+
+BLOCK_SIZE = 2**25 # Bytes of temporaries computed at once
+
+
+def frames(n_samples, fs, nperseg, noverlap=None):
+    """Step, number and center times of the frames scipy.signal.spectrogram computes."""
+    if noverlap is None:
+        noverlap = nperseg // 8
+    step = nperseg - noverlap
+    n_frames = max((n_samples - noverlap) // step, 0)
+    times = (np.arange(n_frames) * step + nperseg / 2) / float(fs)
+    return step, n_frames, times
+
+
+def frequencies(fs, nperseg, fmin=0, fmax=None):
+    """Frequencies of the spectrogram and the slice between fmin and fmax."""
+    f = np.fft.rfftfreq(nperseg, 1 / float(fs))
+    if fmax is None:
+        fmax = f[-1]
+    inds = np.where((f >= fmin) & (f <= fmax))[0]
+    return f[inds], slice(inds[0], inds[-1] + 1)
+
+
+def spectrogram(data, fs, nperseg, fmin=0, fmax=None, workers=1, dtype='float32', out=None):
+    """Power spectrogram of every signal in an array along its last axis.
+
+    Args:
+        data: (..., Time) array
+        fs: sampling frequency
+        nperseg: samples per Hann window
+        fmin, fmax: range of frequencies to keep
+        workers: number of threads the leading axes are split across
+        dtype: type of the output
+        out: optional preallocated (..., Time, Freq) output
+
+    Returns:
+        f: frequencies
+        t: frame center times
+        power: (..., Time, Freq) array
+    """
+    data = np.asarray(data)
+    f, freq_slice = frequencies(fs, nperseg, fmin, fmax)
+    _, n_frames, t = frames(data.shape[-1], fs, nperseg)
+
+    if out is None:
+        out = np.empty(data.shape[:-1] + (n_frames, len(f)), dtype=dtype)
+    if n_frames == 0:
+        return f, t, out
+    if data.ndim == 1:
+        transform(data, fs, nperseg, freq_slice, out)
+        return f, t, out
+
+    # Compute the leading signals in blocks that bound the temporaries
+    signals = data.reshape((-1, data.shape[-1]))
+    power = out.reshape((len(signals),) + out.shape[-2:])
+    per_signal = max(n_frames, 1) * (nperseg + 2 * (nperseg // 2 + 1)) * 8
+    block = max(1, min(BLOCK_SIZE // per_signal, -(-len(signals) // max(workers, 1))))
+    starts = range(0, len(signals), block)
+
+    def run(start):
+        transform(signals[start:start+block], fs, nperseg, freq_slice, power[start:start+block])
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run, starts))
+    else:
+        for start in starts:
+            run(start)
+
+    return f, t, out
+
+
+def transform(data, fs, nperseg, freq_slice, out):
+    n_freqs = freq_slice.stop - freq_slice.start
+    if 4 * n_freqs > nperseg // 2 + 1:
+        # Most frequencies are kept, so compute them all with the FFT
+        _, _, Zxx = signal.spectrogram(data, fs, 'hann', nperseg=nperseg, axis=-1)
+        np.square(np.swapaxes(Zxx[..., freq_slice, :], -1, -2), out=out) # (..., Time x Freq)
+        return
+
+    # Otherwise project every frame onto only the kept frequencies with one matrix product
+    step, n_frames, _ = frames(data.shape[-1], fs, nperseg)
+    basis, scale = dft_basis(float(fs), nperseg, freq_slice.start, freq_slice.stop)
+    segments = sliding_window_view(data, nperseg, axis=-1)[..., :n_frames*step:step, :]
+    projection = segments @ basis
+    Zxx = projection[..., :n_freqs] ** 2
+    Zxx += projection[..., n_freqs:] ** 2
+    Zxx *= scale
+    np.square(Zxx, out=out) # (..., Time x Freq)
+
+
+@lru_cache(maxsize=None)
+def dft_basis(fs, nperseg, start, stop):
+    """Matrix giving the real and imaginary Hann-windowed, mean-detrended DFT
+    of a frame at bins start to stop, and the density scaling of their power."""
+    window = signal.get_window('hann', nperseg)
+    bins = np.arange(start, stop)
+    exponent = np.exp(-2j * np.pi * np.outer(np.arange(nperseg), bins) / nperseg) * window[:, None]
+    exponent = exponent - exponent.mean(axis=0) # Constant detrend of each frame
+    basis = np.concatenate((exponent.real, exponent.imag), axis=1)
+
+    scale = np.full(len(bins), 2.0 / (fs * (window ** 2).sum()))
+    scale[(bins == 0) | ((nperseg % 2 == 0) & (bins == nperseg // 2))] /= 2
+    return basis, scale
+
+
+def chunked_spectrogram(data, fs, nperseg, fmin=0, fmax=None, filename=None, chunk_size=2**20,
+                        sos=None, workers=1, dtype='float32', out=None):
+    """Power spectrogram of a Channels x Time array read chunk by chunk.
+
+    Chunks of ``chunk_size`` samples are read from ``data`` (an ndarray,
+    memmap or lazy array), optionally zero-phase filtered on the fly with
+    ``sos``, and every frame whose window is complete is transformed and
+    written to the output. Samples shared by consecutive frames are carried
+    over between chunks, so the frames are identical to those of
+    :func:`spectrogram` over the whole (filtered) array.
+
+    Args:
+        filename: path of a .npy file to memory-map the output into.
+                  The output is held in memory when not provided.
+        out: Channels x Time x Freq array to write the output into instead
+
+    Returns:
+        f: frequencies
+        t: frame center times
+        power: Channels x Time x Freq array
+    """
+    n_channels, n_samples = data.shape
+    f, _ = frequencies(fs, nperseg, fmin, fmax)
+    step, n_frames, t = frames(n_samples, fs, nperseg)
+
+    if out is not None:
+        if out.shape != (n_channels, n_frames, len(f)):
+            raise Exception("The output array does not have the shape of the spectrogram.")
+    elif filename:
+        out = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                        shape=(n_channels, n_frames, len(f)))
+    else:
+        out = np.empty((n_channels, n_frames, len(f)), dtype=dtype)
+
+    stream = filters.StreamingFilter(sos, mode='zerophase') if sos is not None else None
+    carry = np.empty((n_channels, 0))
+    first_frame = 0 # Index of the frame starting at the beginning of carry
+
+    for start in range(0, n_samples, chunk_size):
+        chunk = np.asarray(data[:, start:start+chunk_size], dtype=float)
+        if stream is not None:
+            chunk = stream.process(chunk)
+            if start + chunk_size >= n_samples:
+                chunk = np.concatenate((chunk, stream.flush()), axis=-1)
+        carry = np.concatenate((carry, chunk), axis=-1)
+
+        # Transform every frame that fits in the samples carried so far
+        n_ready = min(max((carry.shape[-1] - nperseg) // step + 1, 0), n_frames - first_frame)
+        if n_ready > 0:
+            segment = carry[:, :(n_ready - 1) * step + nperseg]
+            _, _, power = spectrogram(segment, fs, nperseg, fmin, fmax, workers=workers, dtype=dtype)
+            out[:, first_frame:first_frame+n_ready] = power
+            carry = carry[:, n_ready * step:]
+            first_frame += n_ready
+
+    if isinstance(out, np.memmap):
+        out.flush()
+
+    return f, t, out
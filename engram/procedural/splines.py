@@ -0,0 +1,70 @@
+'''
+Functions to project spike trains onto a B-spline temporal basis.
+'''
+
+from functools import lru_cache
+from scipy import sparse
+from scipy.interpolate import BSpline
+import numpy as np
+
+
+def knots(n_basis, degree=3):
+    """Clamped, uniformly spaced knots on [0, 1] giving n_basis splines."""
+    n_interior = n_basis - degree - 1
+    if n_interior < 0:
+        raise Exception("At least degree + 1 basis functions are required.")
+    interior = np.linspace(0, 1, n_interior + 2)[1:-1]
+    return tuple(np.concatenate(([0.] * (degree + 1), interior, [1.] * (degree + 1))))
+
+
+@lru_cache(maxsize=None)
+def basis(knots, degree, length):
+    """Sparse (Time x Basis) matrix of B-splines sampled at the centers of length samples.
+
+    Cached per (knots, degree, length), so knots must be a tuple.
+    """
+    x = (np.arange(length) + 0.5) / length
+    n_basis = len(knots) - degree - 1
+    # One unit coefficient per basis function evaluates them all at once
+    design = BSpline(np.asarray(knots), np.eye(n_basis), degree)(x)
+    return sparse.csr_matrix(design)
+
+
+def project(spikes, basis, starts, dtype='float64'):
+    """Coefficients of the spike trains in windows starting at each sample of starts.
+
+    Every spike is placed at its offset in each window containing it, which
+    gives a sparse (Units x Windows) x Time matrix that is multiplied by the
+    basis once for all units and windows.
+
+    Args:
+        spikes: Units x Time sparse matrix (or array) of spike counts
+        basis: Time x Basis matrix, whose rows set the window length
+        starts: first sample of each window (may overlap or fall outside the recording)
+
+    Returns:
+        Units x Windows x Basis array
+    """
+    spikes = sparse.csr_matrix(spikes)
+    length, n_basis = basis.shape
+    starts = np.asarray(starts, dtype='int')
+    order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[order]
+    n_units, n_windows = spikes.shape[0], len(starts)
+
+    # Windows containing each spike
+    units = np.repeat(np.arange(n_units), np.diff(spikes.indptr))
+    times = spikes.indices
+    first = np.searchsorted(sorted_starts, times - length, side='right')
+    last = np.searchsorted(sorted_starts, times, side='right')
+    counts = last - first
+    windows = np.repeat(first - np.cumsum(np.concatenate(([0], counts[:-1]))), counts) \
+                + np.arange(counts.sum())
+    spike = np.repeat(np.arange(len(times)), counts)
+
+    rows = units[spike] * n_windows + order[windows]
+    columns = times[spike] - sorted_starts[windows]
+    windowed = sparse.csr_matrix((spikes.data[spike].astype(dtype), (rows, columns)),
+                                    shape=(n_units * n_windows, length))
+
+    return np.asarray((windowed @ basis).toarray(), dtype=dtype).reshape((n_units, n_windows, n_basis))
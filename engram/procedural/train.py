@@ -1,58 +1,41 @@
 import numpy as np
 import time
-from engram.procedural import models
-import tensorflow as tf
+from engram.procedural import epochs
 
-def train(model_type='CNN',in_matrix=None,labels=None):
+def train(model_type='CNN',in_matrix=None,labels=None,batch_size=32):
+    """Train a model on trials streamed from memory or disk.
 
-    shape = np.asarray(in_matrix).shape[1:]
+    Args:
+        in_matrix: Trials x ... array or memory map, or a list of them (one per session)
+        labels: dict of Trials-long label arrays per category
+        batch_size: trials per training step
+    """
+
+    from engram.procedural import models # TensorFlow is only imported to train
+
+    shape = epochs.trial_shape(in_matrix)
     print('Input Size: '+ str(shape))
     model = models.select(model=model_type,shape=shape)
 
-    trials = len(in_matrix)
-    channels = len(in_matrix[0])
-    times = len(in_matrix[0][0])
-    dim3 = len(in_matrix[0][0][0])
-    reshape = (-1, channels, dim3)
-
     # get categories
     categories = list(labels)
+    targets = np.stack([np.asarray(labels[cat]) for cat in categories], axis=1)
 
     # splitting data into training and testing indices
-    indices = np.arange(len(labels[categories[0]])).astype('int')
+    indices = np.arange(len(targets)).astype('int')
     if len(indices)%2 != 0:
         indices = indices[0:-1]
     np.random.shuffle(indices)
     train_inds,test_inds = np.split(indices,2)
 
-    y_train_bin = []
-    y_val_bin = []
-
-    # Getting training data
-    X_train = [ in_matrix[i] for i in train_inds ]
-    for cat in categories:
-        if not y_train_bin:
-            y_train_bin = [labels[cat][train_inds]]
-        else:
-            y_train_bin.append(labels[cat][train_inds])
-  
-    # Getting test data
-    X_val = [ in_matrix[i] for i in test_inds ]
-    for cat in categories:
-        if not y_val_bin:
-            y_val_bin = [labels[cat][test_inds]]
-        else:
-            y_val_bin.append(labels[cat][test_inds])
-
-    # splitting data into training and testing indices
-    train_ds = create_dataset(X_train, y_train_bin)
-    val_ds = create_dataset(X_val, y_val_bin)
+    # Datasets only hold indices, and trials are read batch by batch
+    train_ds = create_dataset(in_matrix, targets, train_inds, batch_size=batch_size)
+    val_ds = create_dataset(in_matrix, targets, test_inds, batch_size=batch_size, shuffle=False)
 
     EPOCHS = 10
-    batch_size = 32
     history = model.fit(train_ds, 
                         epochs=EPOCHS, 
-                        validation_data=create_dataset(X_val, y_val_bin))
+                        validation_data=val_ds)
     print(history)
     MODEL_NAME = f"models/{round(history.history['accuracy'][-1]*100,2)}-epoch-{history.epoch[-1]}--loss-{round(history.history['loss'][-1],2)}.model"
     model.save(MODEL_NAME)
@@ -62,39 +45,52 @@ def train(model_type='CNN',in_matrix=None,labels=None):
     training_params = {}
     training_params['categories'] = categories
     training_params['train_inds'] = train_inds
-    training_params['train_inds'] = test_inds
+    training_params['test_inds'] = test_inds
 
     return model, training_params
 
 
-def create_dataset(features=None,labels_for_categories=None):
-    """Load and parse dataset.
+def create_dataset(features=None, labels=None, indices=None, batch_size=32, shuffle=True):
+    """Stream (features, labels) mini-batches of the trials at the given indices.
+
     Args:
-        filenames: list of image paths
-        labels: numpy array of shape (BATCH_SIZE, N_LABELS)
-        is_training: boolean to indicate training mode
+        features: Trials x ... array or memory map, or a list of them
+        labels: Trials x Categories array
+        indices: trials to include (all if None)
+        batch_size: trials per batch
+        shuffle: reshuffle the trials every epoch
     """
+    import tensorflow as tf
+
     AUTOTUNE = tf.data.experimental.AUTOTUNE # Adapt preprocessing and prefetching dynamically to reduce GPU and CPU idle time
-    SHUFFLE_BUFFER_SIZE = 1024 # Shuffle the training data by a chunck of 1024 observations
 
-    labels = []
-    for label in labels_for_categories:
-        labels.append(label)
-    
-    labels = np.array(labels).T
-    
-    # Create a first dataset of file paths and labels
-    dataset = tf.data.Dataset.from_tensor_slices((features, labels))
-    # # Parse and preprocess observations in parallel
-    # dataset = dataset.map(parse_function, num_parallel_calls=AUTOTUNE)
-    
-    # This is a small dataset, only load it once, and keep it in memory.
-    dataset = dataset.cache()
-    # Shuffle the data each buffer size
-    dataset = dataset.shuffle(buffer_size=SHUFFLE_BUFFER_SIZE)
-        
-    # Batch the data for multiple steps
-    dataset = dataset.batch(len(labels))
+    labels = np.asarray(labels)
+    if indices is None:
+        indices = np.arange(len(labels))
+    shape = epochs.trial_shape(features)
+
+    def load(batch):
+        # Read the batch in storage order, so memory-mapped trials are read sequentially
+        order = np.argsort(batch)
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        trials = epochs.gather(features, batch[order])[inverse]
+        return trials.astype('float32', copy=False), labels[batch].astype('float32')
+
+    def parse_function(batch):
+        trials, targets = tf.numpy_function(load, [batch], (tf.float32, tf.float32))
+        trials.set_shape((None,) + shape)
+        targets.set_shape((None,) + labels.shape[1:])
+        return trials, targets
+
+    # Only the indices are held in the dataset
+    dataset = tf.data.Dataset.from_tensor_slices(np.asarray(indices, dtype='int64'))
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=len(indices), reshuffle_each_iteration=True)
+    # Batch the indices, then read and convert each batch (numpy_function holds
+    # the GIL, so parallel map calls would not read any faster)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(parse_function)
     # Fetch batches in the background while the model is training.
     dataset = dataset.prefetch(buffer_size=AUTOTUNE)
     
@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for engram.declarative
+"""
+
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from scipy import sparse
+from scipy.signal import resample_poly
+
+from engram.declarative import id as id_module
+from engram.declarative import ID, Bin, FileData, ReaderData, ScaledData, cache, lazy, store
+from engram.procedural import crossval
+from engram.test.test_procedural import RawStub
+
+
+def make_metadata(**kwargs):
+    metadata = {
+        'name': 'test',
+        'project': 'test',
+        'fs': 2000,
+        'bandpass_min': 1,
+        'bandpass_max': 250,
+        '2D_min': 0,
+        '2D_max': 150,
+        't_bin': .1,
+        'norm': True,
+        'norm_method': 'ZSCORE',
+        'log_transform': True,
+        'roi_bounds': (-1, 1),
+        'event_of_interest': 'SAMPLE_RESPONSE',
+    }
+    metadata.update(kwargs)
+    return metadata
+
+
+def make_id(metadata, n_durations=2):
+    random = np.random.RandomState(0)
+    id = ID(metadata)
+    for _ in range(n_durations):
+        id.addDuration(conts=random.randn(4, 40000), cont_channels=[1, 2, 3, 4], bins=None,
+                        events={'SAMPLE_RESPONSE': np.array([5., 10., 15.])})
+    return id
+
+
+class TestStandardize(unittest.TestCase):
+
+    def test_parallel_matches_serial(self):
+        serial = make_id(make_metadata())
+        serial.standardize(form='stft', processes=1)
+        parallel = make_id(make_metadata())
+        parallel.standardize(form='stft', processes=2)
+
+        for expected, actual in zip(serial.durations, parallel.durations):
+            np.testing.assert_array_equal(actual.conts[0].data, expected.conts[0].data)
+            np.testing.assert_array_equal(actual.conts[0].nD_labels['2D'], expected.conts[0].nD_labels['2D'])
+            np.testing.assert_array_equal(actual.conts[0].nD_labels['3D'], expected.conts[0].nD_labels['3D'])
+
+    def test_scratch_files_replace_shared_memory(self):
+        # Python 3.7 has no multiprocessing.shared_memory
+        scratch = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch)
+        serial = make_id(make_metadata(), n_durations=1)
+        serial.standardize(form='stft', processes=1)
+        parallel = make_id(make_metadata(scratch_dir=scratch))
+        with mock.patch('engram.declarative.id.shared_memory', None):
+            parallel.standardize(form='stft', processes=2)
+
+        np.testing.assert_array_equal(parallel.durations[0].conts[0].data, serial.durations[0].conts[0].data)
+        self.assertEqual(os.listdir(scratch), [])
+
+    def test_memory_maps_are_passed_by_reference(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        serial = make_id(make_metadata(), n_durations=1)
+        serial.standardize(form='stft', processes=1)
+        parallel = make_id(make_metadata())
+        for ii, duration in enumerate(parallel.durations):
+            filename = os.path.join(directory, '{}.npy'.format(ii))
+            np.save(filename, duration.conts[0].data)
+            duration.conts[0].data = np.load(filename, mmap_mode='r')
+        self.assertIsNone(id_module.mapping(parallel.durations[0].conts[0].data[1:])) # Views are copied
+
+        with mock.patch('engram.declarative.id.shared_memory', None), \
+                mock.patch('engram.declarative.id.scratch_memmap', wraps=lazy.scratch_memmap) as scratch_memmap:
+            parallel.standardize(form='stft', processes=2)
+        scratch_memmap.assert_not_called() # Nothing was copied for the workers
+        np.testing.assert_array_equal(parallel.durations[0].conts[0].data, serial.durations[0].conts[0].data)
+
+    def test_failed_workers_free_shared_data(self):
+        id = make_id(make_metadata(t_bin=0)) # Empty STFT windows, so every worker raises
+        original = [duration.conts[0].data.copy() for duration in id.durations]
+        with self.assertRaises(ZeroDivisionError):
+            id.standardize(form='stft', processes=2)
+        for duration, data in zip(id.durations, original):
+            self.assertIsNone(duration.conts[0].data.base) # A private copy, not a view of a freed block
+            np.testing.assert_array_equal(duration.conts[0].data, data)
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cachedir)
+
+    def test_hit_returns_identical_features(self):
+        first = make_id(make_metadata(cache_dir=self.cachedir), n_durations=1)
+        first.standardize(form='stft')
+        second = make_id(make_metadata(cache_dir=self.cachedir), n_durations=1)
+        second.standardize(form='stft')
+
+        expected, cached = first.durations[0].conts[0], second.durations[0].conts[0]
+        self.assertIsInstance(cached.data, np.memmap) # Loaded, not recomputed
+        np.testing.assert_array_equal(cached.data, expected.data)
+        for dim in ['1D', '2D', '3D']:
+            np.testing.assert_array_equal(cached.nD_labels[dim], expected.nD_labels[dim])
+
+    def test_every_field_changes_the_key(self):
+        cont = make_id(make_metadata(), n_durations=1).durations[0].conts[0]
+        original = cache.key(cont, 'stft')
+        self.assertEqual(cache.key(cont, 'stft'), original)
+        self.assertNotEqual(cache.key(cont, 'lfp'), original)
+        for field in cache.FIELDS:
+            changed = dict(cont.metadata)
+            changed[field] = 'changed'
+            cont.metadata, metadata = changed, cont.metadata
+            self.assertNotEqual(cache.key(cont, 'stft'), original, field)
+            cont.metadata = metadata
+
+        cont.data = cont.data.copy()
+        cont.data[2, 30000] += 1e-9
+        self.assertNotEqual(cache.key(cont, 'stft'), original)
+
+    def test_least_recently_used_are_evicted(self):
+        cont = make_id(make_metadata(), n_durations=1).durations[0].conts[0]
+        size = cont.data.nbytes
+        for ii, name in enumerate(['a', 'b', 'c']):
+            cache.save(name, cont, self.cachedir, max_size=10 * size)
+            os.utime(os.path.join(self.cachedir, name), (ii, ii)) # Oldest first
+        cache.load('a', make_id(make_metadata(), n_durations=1).durations[0].conts[0], self.cachedir)
+
+        # Room for two entries: b was used least recently
+        cache.evict(self.cachedir, max_size=3 * size)
+        self.assertEqual(sorted(os.listdir(self.cachedir)), ['a', 'c'])
+        total = sum(os.path.getsize(os.path.join(root, filename))
+                    for root, _, filenames in os.walk(self.cachedir) for filename in filenames)
+        self.assertLessEqual(total, 3 * size)
+
+
+class TestScratch(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.scratch)
+
+    def test_scratch_memmap_is_removed(self):
+        out = lazy.scratch_memmap((3, 5), 'float32', self.scratch)
+        out[:] = 1
+        self.assertEqual(os.listdir(self.scratch), [])
+        self.assertEqual(out.sum(), 15)
+
+        # Where open files cannot be removed, the file goes once the mapping is closed
+        with mock.patch('os.remove', side_effect=OSError):
+            out = lazy.scratch_memmap((3, 5), 'float32', self.scratch)
+        self.assertEqual(len(os.listdir(self.scratch)), 1)
+        del out
+        self.assertEqual(os.listdir(self.scratch), [])
+
+        shared = lazy.scratch_memmap((3, 5), 'float32', self.scratch, shared=True)
+        np.testing.assert_array_equal(np.load(shared.filename), np.zeros((3, 5)))
+        lazy.discard(shared)
+        self.assertEqual(os.listdir(self.scratch), [])
+
+    def test_chunked_stft_leaves_no_files(self):
+        chunked = make_id(make_metadata(chunk_size=7000, scratch_dir=self.scratch), n_durations=1)
+        chunked.standardize(form='stft')
+        whole = make_id(make_metadata(), n_durations=1)
+        whole.standardize(form='stft')
+        np.testing.assert_allclose(chunked.durations[0].conts[0].data, whole.durations[0].conts[0].data,
+                                    atol=1e-3)
+        self.assertEqual(os.listdir(self.scratch), [])
+
+    def test_chunked_stft_filters_before_decimating(self):
+        chunked = make_id(make_metadata(chunk_size=7000, scratch_dir=self.scratch, lfp_fs=500), n_durations=1)
+        chunked.standardize(form='stft')
+        whole = make_id(make_metadata(lfp_fs=500), n_durations=1)
+        whole.standardize(form='stft')
+        expected, actual = whole.durations[0].conts[0], chunked.durations[0].conts[0]
+        self.assertEqual(actual.metadata['fs'], 500)
+        np.testing.assert_array_equal(actual.nD_labels['2D'], expected.nD_labels['2D'])
+        np.testing.assert_allclose(actual.data, expected.data, atol=1e-3)
+        self.assertEqual(os.listdir(self.scratch), [])
+
+    def test_chunked_resample_leaves_no_files(self):
+        id = make_id(make_metadata(chunk_size=7000, scratch_dir=self.scratch), n_durations=1)
+        cont = id.durations[0].conts[0]
+        expected = np.array(cont.data)
+        cont.resample(500)
+        self.assertEqual(cont.data.shape, (4, 10000))
+        np.testing.assert_allclose(cont.data, resample_poly(expected, 1, 4, axis=-1), atol=1e-12)
+        self.assertEqual(os.listdir(self.scratch), [])
+
+
+    def test_chunked_trials_leave_no_files(self):
+        id = make_id(make_metadata(chunk_size=7000, scratch_dir=self.scratch), n_durations=1)
+        id.standardize(form='stft')
+        id.extractTrials()
+        trials = id.durations[0].trials['Conts'][0]
+        self.assertIsInstance(trials.data, np.memmap)
+        self.assertEqual(os.listdir(self.scratch), [])
+
+        # Workers are then given a copy, since the file is gone
+        filenames, written = crossval.share([trials.data], scratch_dir=self.scratch)
+        self.assertEqual(filenames, written)
+        np.testing.assert_array_equal(np.load(filenames[0]), trials.data)
+        os.remove(filenames[0])
+
+
+class TestTrials(unittest.TestCase):
+
+    def test_trials_are_one_contiguous_array(self):
+        id = make_id(make_metadata(), n_durations=1)
+        id.standardize(form='stft')
+        id.extractTrials()
+
+        duration = id.durations[0]
+        cont, trials = duration.conts[0], duration.trials['Conts'][0]
+        self.assertEqual(trials.data.shape, (3, 4, len(trials.nD_labels['2D']), len(cont.nD_labels['3D'])))
+        self.assertTrue(trials.data.flags['C_CONTIGUOUS'])
+        start = np.abs(cont.nD_labels['2D'] - (10 + trials.nD_labels['2D'][0])).argmin()
+        np.testing.assert_array_equal(trials[1], cont.data[:, start:start+trials.data.shape[2]])
+
+    def test_event_locked_matches_whole_recording(self):
+        whole = make_id(make_metadata(norm=False), n_durations=1)
+        whole.standardize(form='stft')
+        whole.extractTrials()
+        locked = make_id(make_metadata(norm=False), n_durations=1)
+        locked.extractTrials(form='stft')
+
+        expected = whole.durations[0].trials['Conts'][0]
+        actual = locked.durations[0].trials['Conts'][0]
+        np.testing.assert_allclose(actual.nD_labels['2D'], expected.nD_labels['2D'])
+        np.testing.assert_allclose(actual.data, expected.data, atol=1e-2 * np.abs(expected.data).max())
+
+
+class TestPrecision(unittest.TestCase):
+
+    def test_float32_matches_float64(self):
+        double = make_id(make_metadata(dtype='float64'), n_durations=1)
+        double.standardize(form='stft')
+        single = make_id(make_metadata(dtype='float32'), n_durations=1)
+        single.standardize(form='stft')
+
+        expected, actual = double.durations[0].conts[0].data, single.durations[0].conts[0].data
+        self.assertEqual(expected.dtype, np.float64)
+        self.assertEqual(actual.dtype, np.float32)
+        np.testing.assert_allclose(actual, expected, rtol=1e-3, atol=1e-3)
+
+
+class TestBin(unittest.TestCase):
+
+    def baseline(self, timestamps, fs, length):
+        # Dense histogram built the way Bin did before it was sparse
+        data = np.zeros((len(timestamps), length))
+        for idx, times in enumerate(timestamps):
+            rounded_indices = np.round(np.asarray(times) * fs).astype('int')
+            data[idx][rounded_indices[rounded_indices < length]] = 1
+        return data
+
+    def test_sparse_binning_matches_dense(self):
+        fs = 2000
+        random = np.random.RandomState(12)
+        timestamps = [random.uniform(0, 5, 200), # Unsorted
+                        np.array([3.2, .0005, 1., .00025, .00075, 4.99975, 1.]), # Half-sample edges and duplicates
+                        np.array([])]
+        binary = Bin('test', data=[], timestamps=[[1.]] * 3, channel_labels=[1, 2, 3], metadata=make_metadata(fs=fs))
+        binary.timestamps = timestamps
+        binary.makeVectorsFromTimestamps(length=5 * fs)
+
+        self.assertTrue(sparse.issparse(binary.data))
+        expected = self.baseline(timestamps, fs, 5 * fs)
+        np.testing.assert_array_equal(binary.dense(), expected)
+        np.testing.assert_array_equal(binary.dense(1999, 2001), expected[:, 1999:2001])
+        np.testing.assert_array_equal(binary.dense(0, 2), [[0, 0], [1, 1], [0, 0]])
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.datadir)
+        random = np.random.RandomState(11)
+        self.id = ID(make_metadata())
+        self.spikes = sparse.random(3, 40000, density=.001, format='csr', random_state=random)
+        self.spikes.data[:] = 1
+        self.id.addDuration(conts=random.randn(4, 40000), cont_channels=[1, 2, 3, 4],
+                            bins=self.spikes, bin_channels=[5, 6, 7],
+                            events={'SAMPLE_RESPONSE': np.array([5., 10., 15.]), 'START': np.array([1.])},
+                            labels={'side': [0, 1, 0]})
+
+    def snapshot(self):
+        directory = os.path.join(self.datadir, 'test')
+        with open(os.path.join(directory, store.MANIFEST)) as fp:
+            manifest = json.load(fp)
+        files = {}
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename != store.MANIFEST:
+                    with open(os.path.join(root, filename), 'rb') as fp:
+                        files[os.path.relpath(os.path.join(root, filename), directory)] = fp.read()
+        return manifest, files
+
+    def test_round_trip(self):
+        store.save(self.id, datadir=self.datadir, chunk_size=10000)
+        saved = self.snapshot()
+        loaded = store.load('test', datadir=self.datadir)
+
+        expected, duration = self.id.durations[0], loaded.durations[0]
+        np.testing.assert_array_equal(np.asarray(duration.conts[0].data), expected.conts[0].data)
+        self.assertTrue(sparse.issparse(duration.bins[0].data))
+        np.testing.assert_array_equal(duration.bins[0].data.toarray(), self.spikes.toarray())
+        for dim in ['1D', '2D']:
+            np.testing.assert_array_equal(duration.conts[0].nD_labels[dim], expected.conts[0].nD_labels[dim])
+            np.testing.assert_array_equal(duration.bins[0].nD_labels[dim], expected.bins[0].nD_labels[dim])
+        self.assertEqual(sorted(duration.events), ['SAMPLE_RESPONSE', 'START'])
+        np.testing.assert_array_equal(duration.events['SAMPLE_RESPONSE'], [5., 10., 15.])
+        np.testing.assert_array_equal(duration.trial_labels['side'], [0, 1, 0])
+        self.assertEqual(loaded.metadata['fs'], 2000)
+        self.assertIs(duration.metadata, loaded.metadata) # Still shared after loading
+
+        # Saving the loaded session again leaves the manifest and every file as they were
+        store.save(loaded, datadir=self.datadir, chunk_size=10000)
+        self.assertEqual(self.snapshot(), saved)
+
+    def test_rechunking_a_loaded_session(self):
+        store.save(self.id, datadir=self.datadir, chunk_size=10000)
+        for chunk_size in [4000, 25000]:
+            loaded = store.load('test', datadir=self.datadir)
+            store.save(loaded, datadir=self.datadir, chunk_size=chunk_size)
+            np.testing.assert_array_equal(np.asarray(loaded.durations[0].conts[0].data),
+                                            self.id.durations[0].conts[0].data)
+
+            reloaded = store.load('test', datadir=self.datadir).durations[0].conts[0].data
+            self.assertEqual(reloaded.chunk_size, chunk_size)
+            np.testing.assert_array_equal(np.asarray(reloaded), self.id.durations[0].conts[0].data)
+
+    def test_pickled_sessions_still_load(self):
+        with open(os.path.join(self.datadir, 'test'), 'wb') as fp:
+            pickle.dump(self.id, fp)
+        loaded = ID(make_metadata()).load(datadir=self.datadir)
+        np.testing.assert_array_equal(loaded.durations[0].conts[0].data, self.id.durations[0].conts[0].data)
+
+        # Saving replaces the pickle with a directory
+        store.save(loaded, datadir=self.datadir)
+        self.assertTrue(os.path.isdir(os.path.join(self.datadir, 'test')))
+        reloaded = ID(make_metadata()).load(datadir=self.datadir)
+        np.testing.assert_array_equal(np.asarray(reloaded.durations[0].conts[0].data),
+                                        self.id.durations[0].conts[0].data)
+
+
+class TestLazyData(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = (np.random.RandomState(14).randn(20000, 4) * 1000).astype('int16')
+        self.gain = np.array([.1, .2, .3, .4])
+        self.offset = np.array([0., 1., 2., 3.])
+        self.scaled = (self.raw * self.gain + self.offset).T
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_reader_loads_only_indexed_samples(self):
+        reader = RawStub(self.raw, self.gain, self.offset)
+        data = ReaderData(reader, channel_indexes=[1, 2, 3])
+        self.assertEqual(data.shape, (3, 20000))
+        self.assertEqual(reader.reads, []) # Nothing is read until indexed
+
+        np.testing.assert_allclose(data[1:, 500:700], self.scaled[2:, 500:700])
+        np.testing.assert_allclose(data[0, [10, 40, 20]], self.scaled[1, [10, 40, 20]])
+        self.assertEqual(reader.reads, [(500, 700, (2, 3)), (10, 41, (1,))])
+
+        # The reader comes along when pickled, and reads stay lazy afterwards
+        restored = pickle.loads(pickle.dumps(data))
+        np.testing.assert_allclose(restored[:, -5:], self.scaled[1:, -5:])
+        self.assertEqual(restored.reader.reads[-1], (19995, 20000, (1, 2, 3)))
+
+    def test_file_reloads_its_mapping(self):
+        filename = os.path.join(self.directory, 'signals.npy')
+        np.save(filename, self.scaled)
+        data = FileData(filename)
+        np.testing.assert_array_equal(data[[0, 2], 100:200], self.scaled[[0, 2], 100:200])
+
+        # Only the filename is pickled, and the file is mapped again on load
+        pickled = pickle.dumps(data)
+        self.assertLess(len(pickled), 1000)
+        restored = pickle.loads(pickled)
+        self.assertIsInstance(restored._memmap, np.memmap)
+        np.testing.assert_array_equal(np.asarray(restored), self.scaled)
+
+        # A Cont backed by the file keeps it lazy through a save and load
+        id = ID(make_metadata())
+        id.addDuration(conts=data, cont_channels=[1, 2, 3, 4], bins=None, events={})
+        self.assertIs(id.durations[0].conts[0].data, data)
+        store.save(id, datadir=self.directory)
+        loaded = store.load('test', datadir=self.directory).durations[0].conts[0].data
+        np.testing.assert_array_equal(loaded[:, 123:456], self.scaled[:, 123:456])
+
+
+class TestScaledData(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = (np.random.RandomState(0).randn(4, 40000) * 1000).astype('int16')
+        self.gain = np.array([.1, .2, .3, .4])
+        self.offset = np.array([0., 1., 2., 3.])
+        self.scaled = self.raw * self.gain[:, None] + self.offset[:, None]
+        self.datadir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def test_slices_are_rescaled(self):
+        data = ScaledData(self.raw, self.gain, self.offset)
+        np.testing.assert_allclose(data[1:3, 5:100], self.scaled[1:3, 5:100])
+        np.testing.assert_allclose(data[[0, 3], ::7], self.scaled[[0, 3], ::7])
+
+    def test_store_keeps_raw_samples(self):
+        id = ID(make_metadata())
+        timestamps = [np.array([.5, 1.]), np.array([2.]), np.array([1.5, 3., 4.]), np.array([.25])]
+        id.addDuration(conts=ScaledData(self.raw, self.gain, self.offset), cont_channels=[1, 2, 3, 4],
+                        bins=[], bin_timestamps=timestamps, bin_channels=[1, 2, 3, 4], events={})
+        id.durations[0].bins[0].makeVectorsFromTimestamps()
+        store.save(id, datadir=self.datadir)
+        chunk = os.path.join(self.datadir, 'test', 'id', 'durations', '0', 'conts', '0', 'data', 'raw', '00000.npy')
+        self.assertEqual(np.load(chunk).dtype, np.int16)
+
+        duration = store.load('test', datadir=self.datadir, channels=[2, 4]).durations[0]
+        data = duration.conts[0].data
+        self.assertIsInstance(data, ScaledData)
+        np.testing.assert_allclose(np.asarray(data), self.scaled[[1, 3]])
+
+        # Spike times stay aligned with the units that are kept
+        binary = duration.bins[0]
+        np.testing.assert_array_equal(binary.nD_labels['1D'], [2, 4])
+        self.assertEqual(len(binary.timestamps), 2)
+        for times, expected, row in zip(binary.timestamps, [timestamps[1], timestamps[3]], binary.data.toarray()):
+            np.testing.assert_array_equal(times, expected)
+            np.testing.assert_array_equal(np.where(row)[0], np.round(expected * 2000))
+
+
+if __name__ == '__main__':
+    unittest.main()
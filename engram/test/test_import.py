@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests that importing engram stays light
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+import engram
+
+HEAVY = ['tensorflow', 'neo', 'vispy', 'visbrain', 'scipy.io']
+
+
+def import_in_subprocess(statement, modules=HEAVY):
+    """Which of the modules an import statement loads, in a fresh interpreter."""
+    script = ("import sys\n"
+              "{}\n"
+              "print(','.join(name for name in {!r} if name in sys.modules))").format(statement, modules)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(engram.__file__)))
+    output = subprocess.run([sys.executable, '-c', script], cwd=root, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+    return [name for name in output.split(',') if name]
+
+
+class TestImport(unittest.TestCase):
+
+    def test_import_does_not_load_heavy_modules(self):
+        loaded = import_in_subprocess('import engram')
+        self.assertEqual(loaded, [])
+
+    def test_containers_do_not_load_models_or_graphics(self):
+        loaded = import_in_subprocess('from engram.declarative import ID',
+                                        HEAVY + ['engram.procedural.crossval', 'engram.procedural.decoders'])
+        self.assertEqual(loaded, [])
+
+    def test_star_import_exports_the_public_api(self):
+        namespace = {}
+        exec('from engram import *', namespace)
+        for name in ['ID', 'Duration', 'Bin', 'Cont', 'Trials', 'declarative', 'procedural', 'episodic',
+                        'filters', 'spectral', 'train', 'envs', 'logging_handler']:
+            self.assertIn(name, namespace)
+        self.assertIs(namespace['Cont'], engram.declarative.Cont)
+        self.assertIs(namespace['filters'], engram.procedural.filters)
+
+    def test_names_resolve_on_first_use(self):
+        from engram.declarative import ID
+        from engram.procedural import epochs
+        self.assertIs(engram.ID, ID)
+        self.assertIs(engram.procedural.epochs, epochs)
+        self.assertIs(engram.epochs, epochs)
+
+
+if __name__ == '__main__':
+    unittest.main()
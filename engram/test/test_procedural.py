@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for engram.procedural
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from scipy import signal, sparse
+from scipy.signal import butter, resample_poly, sosfilt, sosfilt_zi, sosfiltfilt
+
+from engram.procedural import crossval, decoders, epochs, filters, kernels, normalization, predict, resampling, signals, spectral, splines, train
+
+
+class RawStub(object):
+    """In-memory stand-in for a parsed Neo RawIO reader that records every chunk read."""
+
+    def __init__(self, raw, gain, offset, fs=2000.):
+        self.raw = raw # Time x Channels, as RawIO returns it
+        self.fs = fs
+        self.header = {'signal_channels': np.array(
+            [('ch{}'.format(ii), ii, fs, str(raw.dtype), 'uV', g, o, '0') for ii, (g, o) in enumerate(zip(gain, offset))],
+            dtype=[('name', 'U64'), ('id', 'U64'), ('sampling_rate', 'float64'), ('dtype', 'U16'),
+                    ('units', 'U64'), ('gain', 'float64'), ('offset', 'float64'), ('stream_id', 'U64')])}
+        self.reads = []
+
+    def get_signal_size(self, block_index=0, seg_index=0):
+        return len(self.raw)
+
+    def get_signal_sampling_rate(self):
+        return self.fs
+
+    def get_analogsignal_chunk(self, block_index=0, seg_index=0, i_start=None, i_stop=None, channel_indexes=None):
+        channel_indexes = np.arange(self.raw.shape[1]) if channel_indexes is None else np.asarray(channel_indexes)
+        self.reads.append((i_start, i_stop, tuple(channel_indexes)))
+        return self.raw[i_start:i_stop][:, channel_indexes]
+
+    def rescale_signal_raw_to_float(self, raw_sigs, dtype='float64', channel_indexes=None):
+        channels = self.header['signal_channels']
+        if channel_indexes is not None:
+            channels = channels[np.asarray(channel_indexes)]
+        return (raw_sigs * channels['gain'] + channels['offset']).astype(dtype)
+
+
+class TestSignals(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = (np.random.RandomState(13).randn(10001, 5) * 1000).astype('int16')
+        self.gain = np.array([.1, .2, .3, .4, .5])
+        self.offset = np.array([0., 1., 2., 3., 4.])
+        self.scaled = (self.raw * self.gain + self.offset).T
+
+    def test_chunked_reads_of_selected_channels(self):
+        reader = RawStub(self.raw, self.gain, self.offset)
+        data, fs = signals.read(reader, channels=[3, 1], chunk_size=4000)
+        self.assertEqual(fs, 2000.)
+        np.testing.assert_allclose(data, self.scaled[[3, 1]])
+        self.assertEqual(reader.reads, [(0, 4000, (3, 1)), (4000, 8000, (3, 1)), (8000, 10001, (3, 1))])
+
+    def test_raw_reads_into_a_memory_map(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'raw.npy')
+        data, gain, offset, fs = signals.read_raw(RawStub(self.raw, self.gain, self.offset), channels=[0, 4],
+                                                    filename=filename, chunk_size=3000)
+        stored = np.load(filename, mmap_mode='r')
+        self.assertEqual(stored.dtype, np.int16)
+        np.testing.assert_array_equal(stored, self.raw[:, [0, 4]].T)
+        np.testing.assert_allclose(stored * gain[:, None] + offset[:, None], self.scaled[[0, 4]])
+
+
+class TestStreamingFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.sos = filters.butter_sos(1, 250, 2000)
+        self.data = np.random.RandomState(0).randn(3, 60000)
+        self.chunks = [5, 2000, 20000, 1, 37994]
+
+    def stream(self, mode):
+        stream = filters.StreamingFilter(self.sos, mode=mode)
+        output, start = [], 0
+        for size in self.chunks:
+            output.append(stream.process(self.data[:, start:start+size]))
+            start += size
+        output.append(stream.flush().reshape(len(self.data), -1))
+        return np.concatenate(output, axis=-1)
+
+    def test_causal_matches_whole_array(self):
+        zi = sosfilt_zi(self.sos)[:, None, :] * self.data[None, :, 0, None]
+        expected, _ = sosfilt(self.sos, self.data, axis=-1, zi=zi)
+        np.testing.assert_allclose(self.stream('causal'), expected, atol=1e-10)
+
+    def test_zerophase_matches_whole_array(self):
+        expected = sosfiltfilt(self.sos, self.data, axis=-1)
+        np.testing.assert_allclose(self.stream('zerophase'), expected, atol=1e-5)
+
+    def test_one_dimensional(self):
+        stream = filters.StreamingFilter(self.sos, mode='zerophase')
+        output = np.concatenate([stream.process(self.data[0, :30000]),
+                                stream.process(self.data[0, 30000:]), stream.flush()])
+        np.testing.assert_allclose(output, sosfiltfilt(self.sos, self.data[0]), atol=1e-5)
+
+
+class TestFilters(unittest.TestCase):
+
+    def test_threaded_blocks_match_sosfiltfilt(self):
+        sos = filters.butter_sos(1, 250, 2000)
+        data = np.random.RandomState(15).randn(6, 60, 500)
+        for axis in [-1, 1]:
+            expected = sosfiltfilt(sos, data, axis=axis)
+            for workers in [1, 3]:
+                output = filters.sos_filter(data, sos, axis=axis, workers=workers)
+                np.testing.assert_allclose(output, expected, rtol=0, atol=1e-12)
+        output = filters.sos_filter(data, sos, workers=4, dtype='float32')
+        self.assertEqual(output.dtype, np.float32)
+        np.testing.assert_allclose(output, sosfiltfilt(sos, data), atol=1e-5)
+
+    def test_chunked_matches_whole(self):
+        sos = filters.butter_sos(1, 250, 2000)
+        data = np.random.RandomState(20).randn(3, 20000)
+        for chunk_size in [1000, 7000, 20000]:
+            output = filters.chunked_filter(data, sos, chunk_size=chunk_size)
+            np.testing.assert_allclose(output, sosfiltfilt(sos, data), atol=1e-5)
+
+    def test_cached_designs_cannot_be_changed(self):
+        sos = filters.butter_sos(1, 250, 2000)
+        sos[0, 0] = 0
+        np.testing.assert_allclose(filters.butter_sos(1, 250, 2000),
+                                    butter(5, [1 / 1000., 250 / 1000.], btype='band', output='sos'))
+
+
+class TestSpectral(unittest.TestCase):
+
+    def test_batched_matches_scipy(self):
+        data = np.random.RandomState(16).randn(3, 2, 4000)
+        f, t, Sxx = signal.spectrogram(data, 2000, 'hann', nperseg=200, axis=-1)
+        # A narrow band takes the DFT projection, a wide one the FFT
+        for fmin, fmax, workers in [(0, 150, 1), (0, None, 1), (20, 80, 3)]:
+            keep = (f >= fmin) & (f <= (fmax if fmax is not None else f[-1]))
+            expected = np.swapaxes(Sxx[..., keep, :], -1, -2) ** 2
+            freqs, times, power = spectral.spectrogram(data, 2000, 200, fmin=fmin, fmax=fmax,
+                                                        workers=workers, dtype='float64')
+            np.testing.assert_array_equal(freqs, f[keep])
+            np.testing.assert_allclose(times, t)
+            self.assertEqual(power.shape, (3, 2, len(t), keep.sum()))
+            np.testing.assert_allclose(power, expected, rtol=1e-8, atol=1e-14)
+
+    def test_float32_output(self):
+        data = np.random.RandomState(17).randn(4, 4000)
+        _, _, expected = spectral.spectrogram(data, 2000, 200, fmax=150, dtype='float64')
+        _, _, power = spectral.spectrogram(data, 2000, 200, fmax=150)
+        self.assertEqual(power.dtype, np.float32)
+        np.testing.assert_allclose(power, expected, rtol=1e-4, atol=1e-12)
+
+
+class TestNormalization(unittest.TestCase):
+
+    def setUp(self):
+        self.data = np.random.RandomState(1).gamma(2, size=(4, 5000, 6)).astype('float32')
+
+    def test_running_stats_match_numpy(self):
+        stats = normalization.RunningStats(axis=1)
+        for start in range(0, 5000, 777):
+            stats.update(self.data[:, start:start+777])
+        np.testing.assert_allclose(stats.mean[:, 0], self.data.mean(axis=1), rtol=1e-5)
+        np.testing.assert_allclose(stats.std[:, 0], self.data.std(axis=1, dtype='float64'), rtol=1e-5)
+
+    def test_zscore_in_place(self):
+        expected = 10 * np.log10(self.data.astype('float64'))
+        expected = (expected - expected.mean(axis=1, keepdims=True)) / expected.std(axis=1, keepdims=True)
+        output = normalization.zscore(self.data, axis=1, log_transform=True)
+        self.assertIs(output, self.data)
+        np.testing.assert_allclose(output, expected, atol=1e-4)
+
+
+class TestResampling(unittest.TestCase):
+
+    def test_chunked_matches_resample_poly(self):
+        data = np.random.RandomState(2).randn(3, 50001)
+        for new_fs in [500, 300, 2500]:
+            up, down = resampling.ratio(2000, new_fs)
+            expected = resample_poly(data, up, down, axis=-1)
+            output, fs = resampling.resample(data, 2000, new_fs, chunk_size=4093)
+            self.assertEqual(fs, new_fs)
+            np.testing.assert_allclose(output, expected, atol=1e-12)
+
+
+class TestKernels(unittest.TestCase):
+
+    def test_methods_match_dense_convolution(self):
+        trains = (np.random.RandomState(3).rand(5, 20000) < .01).astype(float)
+        for kernel, width in [('triangular', 50), ('gaussian', 10), ('exponential', 20)]:
+            weights, origin = kernels.select(kernel, width)
+            expected = np.array([np.convolve(train, weights)[origin:origin+20000] for train in trains])
+            for method in ['scatter', 'fft']:
+                output = kernels.convolve(sparse.csr_matrix(trains), kernel, width, start=1234, stop=5678,
+                                            method=method)
+                np.testing.assert_allclose(output, expected[:, 1234:5678], atol=1e-12)
+
+
+class TestSplines(unittest.TestCase):
+
+    def test_projection_matches_dense_windows(self):
+        trains = (np.random.RandomState(4).rand(3, 5000) < .02).astype(float)
+        basis = splines.basis(splines.knots(6), 3, 200)
+        starts = np.array([1000, -50, 4900, 1100, 300]) # Unsorted, overlapping and past the edges
+
+        output = splines.project(sparse.csr_matrix(trains), basis, starts)
+        padded = np.pad(trains, ((0, 0), (200, 200)))
+        for window, start in enumerate(starts):
+            np.testing.assert_allclose(output[:, window], padded[:, start+200:start+400] @ basis.toarray())
+
+
+class TestTrain(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(18)
+        self.sessions = [rng.randn(10, 3, 8).astype('float32'), rng.randn(7, 3, 8).astype('float32')]
+        self.labels = {'left': np.arange(17) % 2, 'right': (np.arange(17) + 1) % 2}
+
+    def test_dataset_streams_every_trial_once(self):
+        targets = np.stack([self.labels['left'], self.labels['right']], axis=1)
+        trials = np.concatenate(self.sessions)
+        dataset = train.create_dataset(self.sessions, targets, indices=np.arange(2, 17), batch_size=4)
+        seen = []
+        for batch, batch_targets in dataset:
+            self.assertLessEqual(len(batch), 4)
+            for trial, target in zip(batch.numpy(), batch_targets.numpy()):
+                index = np.where((trials == trial).all(axis=(1, 2)))[0][0]
+                np.testing.assert_array_equal(target, targets[index])
+                seen.append(index)
+        self.assertEqual(sorted(seen), list(range(2, 17)))
+
+    def test_train_smoke(self):
+        import tensorflow as tf
+        from engram.procedural import models
+        model = tf.keras.Sequential([tf.keras.Input((3, 8)), tf.keras.layers.Flatten(),
+                                        tf.keras.layers.Dense(2, activation='sigmoid')])
+        model.compile(loss='binary_crossentropy', optimizer='adam', metrics=['accuracy'])
+        with mock.patch.object(models, 'select', return_value=model) as select, \
+                mock.patch.object(model, 'save') as save: # Nothing is written to models/
+            trained, params = train.train('CNN', self.sessions, self.labels, batch_size=4)
+        select.assert_called_once_with(model='CNN', shape=(3, 8))
+        save.assert_called_once()
+        self.assertIs(trained, model)
+        self.assertEqual(params['categories'], ['left', 'right'])
+        self.assertEqual(len(np.intersect1d(params['train_inds'], params['test_inds'])), 0)
+
+
+class TestEpochs(unittest.TestCase):
+
+    def test_windows_are_fixed_length_views(self):
+        labels = np.arange(10000) / 2000.
+        data = np.random.RandomState(5).randn(3, 10000)
+        times = np.array([.0003, 1.2, 2.5011, 4.9999])
+        starts, length = epochs.locate(labels, times, (-.5, .5))
+
+        self.assertEqual(length, 2000)
+        np.testing.assert_array_equal(starts, [0, 1400, 4002, 8000])
+        for start, window in zip(starts, epochs.views(data, starts, length)):
+            self.assertTrue(np.shares_memory(window, data))
+            np.testing.assert_array_equal(window, data[:, start:start+length])
+
+    def test_sliding_batches_cover_every_window(self):
+        data = np.random.RandomState(6).randn(3, 1000, 5)
+        spikes = sparse.csr_matrix((np.random.RandomState(7).rand(4, 1000) < .05).astype(float))
+        for source, dense in [(data, data), (spikes, spikes.toarray())]:
+            starts = []
+            for batch_starts, windows in epochs.batches(source, 100, step=30, batch_size=7):
+                for start, window in zip(batch_starts, windows):
+                    np.testing.assert_array_equal(window, dense[:, start:start+100])
+                starts.extend(batch_starts)
+            np.testing.assert_array_equal(starts, np.arange(0, 901, 30))
+
+
+class TestCrossValidation(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(8)
+        self.labels = {'side': rng.randint(0, 2, 90)}
+        trials = rng.randn(90, 3, 20) + 2 * self.labels['side'][:, None, None]
+        self.sessions = [trials[:30], trials[30:55], trials[55:]]
+
+    def test_folds_partition_the_trials(self):
+        for folds in [crossval.kfold(90, k=4, seed=0), crossval.leave_one_session_out(self.sessions)]:
+            tests = np.concatenate([test for _, test in folds])
+            np.testing.assert_array_equal(np.sort(tests), np.arange(90))
+            for train_inds, test_inds in folds:
+                self.assertEqual(len(np.intersect1d(train_inds, test_inds)), 0)
+                self.assertEqual(len(train_inds) + len(test_inds), 90)
+
+    def test_parallel_folds_match_serial(self):
+        folds = crossval.leave_one_session_out(self.sessions)
+        serial = crossval.run(self.sessions, self.labels, folds, 'centroid')
+        parallel = crossval.run(self.sessions, self.labels, folds, decoders.NearestCentroid, processes=2)
+        self.assertEqual([fold['n_test'] for fold in serial['side']['folds']], [30, 25, 35])
+        self.assertEqual([fold['accuracy'] for fold in serial['side']['folds']],
+                            [fold['accuracy'] for fold in parallel['side']['folds']])
+        self.assertGreater(serial['side']['accuracy'], .9)
+
+
+class TestDecoders(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(9)
+        self.y = rng.randint(0, 3, 120)
+        self.X = rng.randn(120, 4, 50) + rng.randn(3, 4, 50)[self.y]
+
+    def test_decoders_separate_classes(self):
+        for name in ['LDA', 'ridge', 'logistic', 'centroid']:
+            decoder = decoders.select(name).fit(self.X[:80], self.y[:80])
+            self.assertGreater(decoder.score(self.X[80:], self.y[80:]), .9, name)
+
+    def test_lda_matches_shrunk_covariance(self):
+        # More features than trials, so the covariance is inverted through the SVD
+        X, y = self.X[:80].reshape((80, -1)), self.y[:80]
+        means = np.stack([X[y == label].mean(axis=0) for label in range(3)])
+        within = (X - means[y]).T @ (X - means[y]) / (len(y) - 3)
+        shrunk = .9 * within + .1 * np.trace(within) / len(within) * np.eye(len(within))
+        decoder = decoders.LDA(shrinkage=.1).fit(self.X[:80], y)
+        np.testing.assert_allclose(decoder.coef, np.linalg.solve(shrunk, means.T), atol=1e-10)
+
+
+class TestPredict(unittest.TestCase):
+
+    def test_batches_and_single_trials_agree(self):
+        rng = np.random.RandomState(10)
+        y = rng.randint(0, 2, 60)
+        X = rng.randn(60, 3, 20) + 2 * y[:, None, None]
+        decoder = decoders.select('LDA').fit(X, y)
+
+        choices, outputs = predict.predict_batch(decoder, [X[:25], X[25:]], batch_size=7, options=['A', 'B'])
+        np.testing.assert_allclose(outputs, decoder.decision(X.astype('float32')))
+        predictor = predict.Predictor(decoder, X.shape[1:], options=['A', 'B'])
+        self.assertEqual([predictor(trial) for trial in X], list(choices))
+        self.assertEqual(len(predictor.latencies), 60)
+        self.assertEqual(sorted(predictor.latency()), [50, 90, 99])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
-from engram.declarative import ID
-from engram.procedural import events
+from engram.declarative import ID, FileData, ScaledData
+from engram.procedural import events, signals
 from settings import ramconfig
 from scipy.io import loadmat
 import neo
@@ -21,18 +21,17 @@ if not existingEngrams:
     filename = os.path.join(tracedir, f"{metadata['name']}",
                                             f"{metadata['name']}{metadata['extensions']['signals']}")
     reader = neo.get_io(filename=filename)
+    reader.parse_header()
 
-    blks = reader.read(lazy=False)
-    for blk in blks:
-        for seg in blk.segments:
-            raw_sigs = reader.get_analogsignal_chunk(block_index=0, seg_index=0)
-            float_sigs = reader.rescale_signal_raw_to_float(raw_sigs, dtype='float64')
-            data = np.transpose(float_sigs)
-            fs = reader.get_signal_sampling_rate()
-            units = reader.header['signal_channels'][0]['units']
+    # Copy only the selected streams, chunk by chunk and in their native type, into a memory-mapped array
+    streamsname = os.path.join(tracedir, f"{metadata['name']}",
+                                            f"{metadata['name']}_signals.npy")
+    _, gain, offset, _ = signals.read_raw(reader, channels=np.asarray(metadata['all_streams'])-1,
+                                            filename=streamsname)
+    data = ScaledData(FileData(streamsname), gain, offset,
+                        dtype=metadata.get('dtype', 'float64')) # Samples are only loaded and rescaled when indexed
 
     print('GET NEURONS FROM HERE INSTEAD')
-    data = data[np.asarray(metadata['all_streams'])-1]
 
     # Load Events
     eventsname = os.path.join(tracedir, f"{metadata['name']}",
@@ -76,8 +75,7 @@ else:
     id = ID(metadata).load()
     print('Loaded!')
 
-id.standardize(form='stft')
-id.extractTrials()
+id.extractTrials(form='stft') # Spectrograms around each event only
 id.episode(shader='engram')
 
 # id.model('channels', 'MD')
\ No newline at end of file
@@ -13,16 +13,34 @@ metadata = {
     'bandpass_max': 250, # Maximum LFP Bandpass Frequency 
     '2D_min': 0, # Minimum Frequency of Interest
     '2D_max': 150, # Maximum Frequency of Interest 
+    'lfp_fs': None, # Frequency to decimate to after filtering, before the STFT (None to keep fs)
     't_bin': .1, # In Seconds (for STFT)
     'f_bin': .5, # In Hz (for STFT)
     'overlap': .05, # For STFT
+    'n_basis': 8, # B-spline basis functions per t_bin window (for bspline features)
+    'spline_degree': 3, # Degree of the B-spline basis
     'norm': True, # Normalization (binary choice)
-    'norm_method':'ZSCORE', # Normalization (method)
+    'norm_method':'ZSCORE', # Normalization (method: 'ZSCORE' over each session or 'BASELINE' within each trial)
+    'baseline_bounds': (-1,0), # In seconds around the event of interest (for BASELINE normalization)
     'log_transform': True, # Option to Log-Transform Your Data Before Normalization (binary choice)
     'roi':'events', # Method of choosing your ROI (either 'events' or 'trials')
     'roi_bounds': (-1,1), # In seconds centered around the event of interest
     'event_of_interest': 'SAMPLE_RESPONSE', # Must be a label in your events file
-    'model': [] # If desired for ML
+    'window_length': 1, # In seconds (for sliding windows across a whole duration)
+    'window_step': .1, # In seconds between the starts of consecutive sliding windows
+    'batch_size': 1024, # Windows yielded at once by sliding windows
+    'model': [], # If desired for ML
+    'training_batch_size': 32, # Trials per training step
+    'spike_kernel': 'triangular', # Kernel that smooths spikes for display ('triangular', 'gaussian' or 'exponential')
+    'display_window': None, # (start, stop) in seconds of the recording to display (None for the first 100000 samples)
+    'cache_dir': None, # Directory for cached features, e.g. 'cache' (None to disable)
+    'cache_size': 10 * 2**30, # Maximum size of the feature cache in bytes
+    'dtype': 'float64', # Floating point type of signals and features ('float32' halves memory)
+    'settling_tol': 1e-3, # Filter transient left at the edges of event-locked windows (sets how much is read around them)
+    'workers': 1, # Threads used by filters and spectrograms
+    'processes': 1, # Processes that standardize Conts and cross-validate folds in parallel
+    'chunk_size': None, # Samples per chunk for out-of-core spectrograms (None to process in memory)
+    'scratch_dir': None # Directory for memory-mapped intermediate arrays (system default if None)
 }
 
 CA1_OFFSET = 5
@@ -25,7 +25,9 @@ metadata = {
     'roi':'events',
     'roi_bounds': (-1,1), # Two-second window centered at the event
     'event_of_interest': 'SAMPLE_RESPONSE',
-    'model': []
+    'model': [],
+    'cache_dir': None,
+    'cache_size': 10 * 2**30
 }
 
 # RIGHT = 28